@@ -0,0 +1,23 @@
+import multiprocessing
+import os
+
+# Server for the live ICO streams (see `ico.utils.events`). Streams are long
+# lived and mostly idle, so they are served by gevent workers that keep each
+# open stream in a greenlet instead of a thread or a process.
+
+bind = '0.0.0.0:8000'
+workers = multiprocessing.cpu_count()
+worker_class = 'gevent'
+# Open streams per worker.
+worker_connections = int(os.environ.get('STREAM_WORKER_CONNECTIONS', 2000))
+name = os.environ.get('PROJECT_NAME')
+log_level = 'info'
+log_file = '-'
+pythonpath = '/app/'
+forwarded_allow_ips = '*'
+
+
+def post_fork(server, worker):
+    # Make psycopg2 yield to other greenlets while it waits for Postgres.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -174,11 +174,77 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'ico_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        }
     }
 }
 
 CACHE_DIR = os.path.join(PROJECT_DIR, 'var/cache')
 
+# Seconds that introspected Rehive tokens and invalid tokens are cached.
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 60))
+AUTH_NEGATIVE_CACHE_TTL = int(os.environ.get('AUTH_NEGATIVE_CACHE_TTL', 10))
+
+# Outbound HTTP connection pooling, shared per process by the Rehive and
+# exchange requests. The API runs sync gunicorn workers so a process only has
+# one request in flight, pools only need to be larger if threads are used.
+# Live ICO streams run on separate gevent workers that make no outbound
+# requests.
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 4))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 4))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+# Retries apply to connection errors and to idempotent requests only.
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.3))
+
+# Delivery of queued Rehive commands. Failed deliveries are retried after
+# OUTBOX_RETRY_BACKOFF * 2 ** attempts seconds, up to OUTBOX_MAX_RETRY_DELAY.
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_RETRY_BACKOFF = int(os.environ.get('OUTBOX_RETRY_BACKOFF', 2))
+OUTBOX_MAX_RETRY_DELAY = int(os.environ.get('OUTBOX_MAX_RETRY_DELAY', 600))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1))
+
+# Webhook events are queued and processed by the webhook workers if enabled,
+# otherwise they are processed during the webhook request.
+WEBHOOK_QUEUE_ENABLED = os.environ.get('WEBHOOK_QUEUE_ENABLED', '') == 'True'
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 10))
+WEBHOOK_RETRY_BACKOFF = int(os.environ.get('WEBHOOK_RETRY_BACKOFF', 2))
+WEBHOOK_MAX_RETRY_DELAY = int(os.environ.get('WEBHOOK_MAX_RETRY_DELAY', 600))
+WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', 1))
+
+# Seconds between folding sharded ICO inventories into the public remaining
+# amount.
+INVENTORY_FOLD_INTERVAL = float(os.environ.get('INVENTORY_FOLD_INTERVAL', 5))
+
+# Seconds between folding completed purchases into the ICO sales rollups, and
+# the number of purchases folded per transaction.
+SALES_FOLD_INTERVAL = float(os.environ.get('SALES_FOLD_INTERVAL', 5))
+SALES_FOLD_BATCH_SIZE = int(os.environ.get('SALES_FOLD_BATCH_SIZE', 1000))
+
+# Maximum number of quotes priced in a single bulk quote request.
+MAX_BULK_QUOTES = int(os.environ.get('MAX_BULK_QUOTES', 100))
+
+# Seconds a quote can be used for a purchase, and seconds after expiry that
+# unused quotes are deleted by the quote reaper.
+QUOTE_TTL = int(os.environ.get('QUOTE_TTL', 600))
+QUOTE_REAP_GRACE = int(os.environ.get('QUOTE_REAP_GRACE', 3600))
+QUOTE_REAP_INTERVAL = int(os.environ.get('QUOTE_REAP_INTERVAL', 300))
+
+# Live ICO streams: seconds between keep-alive comments, seconds before a
+# stream is ended and seconds clients wait before reconnecting.
+ICO_STREAM_KEEPALIVE = int(os.environ.get('ICO_STREAM_KEEPALIVE', 15))
+ICO_STREAM_MAX_AGE = int(os.environ.get('ICO_STREAM_MAX_AGE', 300))
+ICO_STREAM_RETRY = int(os.environ.get('ICO_STREAM_RETRY', 3))
+
+# Database connections per stream process used to load the state of newly
+# watched ICOs, in addition to the connection of the change listener.
+ICO_STREAM_DB_CONNECTIONS = int(os.environ.get('ICO_STREAM_DB_CONNECTIONS', 4))
+
+# Seconds between exchange rate snapshots taken by the rate refresher.
+RATE_REFRESH_INTERVAL = int(os.environ.get('RATE_REFRESH_INTERVAL', 600))
+
 FORMAT_MODULE_PATH = 'config.formats'
 
 # Logging
@@ -4,14 +4,21 @@ from ico.models import *
 
 class RateAdmin(admin.ModelAdmin):
     list_display = Rate._meta.get_all_field_names()
+    list_select_related = ('phase', 'currency', 'snapshot',)
 
 
 admin.site.register(User)
 admin.site.register(Company)
 admin.site.register(Currency)
 admin.site.register(Ico)
+admin.site.register(IcoShard)
 admin.site.register(Phase)
 admin.site.register(Rate, RateAdmin)
+admin.site.register(RateSnapshot)
 admin.site.register(Quote)
 admin.site.register(PurchaseMessage)
+admin.site.register(PurchaseTotal)
+admin.site.register(SalesRollup)
 admin.site.register(Purchase)
+admin.site.register(RehiveCommand)
+admin.site.register(WebhookTask)
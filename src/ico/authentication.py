@@ -1,21 +1,42 @@
 import uuid
+import hashlib
 
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import smart_text
 from rest_framework import authentication, exceptions
-from rehive import Rehive, APIException
+from rehive import APIException
 
 from .models import Company, User
+from .utils.sessions import get_rehive
 
 from logging import getLogger
 
 logger = getLogger('django')
 
 
+# Cache keys
+# ================
+TOKEN_CACHE_KEY = 'ico_service_token_{}'
+
+
+def get_token_cache_key(token):
+    return TOKEN_CACHE_KEY.format(
+        hashlib.sha256(token.encode('utf-8')).hexdigest())
+
+
+def invalidate_token(token):
+    """
+    Remove the cached introspection of a token.
+    """
+    cache.delete(get_token_cache_key(token))
+
+
 class HeaderAuthentication(authentication.BaseAuthentication):
     """
     Authentication utility class.
-    """  
+    """
 
     @staticmethod
     def get_auth_header(request, name="token"):
@@ -33,61 +54,99 @@ class HeaderAuthentication(authentication.BaseAuthentication):
         return auth[1]
 
 
-class AdminAuthentication(HeaderAuthentication):
+class TokenAuthentication(HeaderAuthentication):
     """
-    Authentication for admin users.
+    Authentication utility class for Rehive tokens. The introspected Rehive
+    user, its permission groups and the local user and company ids are
+    cached for a short time, invalid tokens are cached as well.
     """
 
+    inactive_company_message = _("Inactive company.")
+
+    def check_user(self, rehive_user):
+        pass
+
+    def introspect(self, token):
+        cache_key = get_token_cache_key(token)
+        entry = cache.get(cache_key)
+
+        if entry is None:
+            try:
+                user = get_rehive(token).user.get()
+            except APIException:
+                cache.set(cache_key, {'valid': False},
+                    settings.AUTH_NEGATIVE_CACHE_TTL)
+                raise exceptions.AuthenticationFailed(_('Invalid user'))
+
+            entry = {
+                'valid': True,
+                'identifier': user['identifier'],
+                'company': user['company'],
+                'permission_groups': [p['name']
+                    for p in user['permission_groups']],
+                'user_id': None,
+            }
+
+        if not entry['valid']:
+            raise exceptions.AuthenticationFailed(_('Invalid user'))
+
+        self.check_user(entry)
+
+        user = None
+        if entry['user_id']:
+            try:
+                user = User.objects.select_related('company__admin').get(
+                    id=entry['user_id'])
+            except User.DoesNotExist:
+                pass
+
+        if user is None:
+            try:
+                company = Company.objects.select_related('admin').get(
+                    identifier=entry['company'])
+            except Company.DoesNotExist:
+                cache.set(cache_key, entry, settings.AUTH_NEGATIVE_CACHE_TTL)
+                raise exceptions.AuthenticationFailed(
+                    self.inactive_company_message)
+
+            user, created = User.objects.get_or_create(
+                identifier=uuid.UUID(entry['identifier']).hex,
+                company=company)
+            entry['user_id'] = user.id
+            cache.set(cache_key, entry, settings.AUTH_CACHE_TTL)
+
+        return user
+
     def authenticate(self, request):
         token = self.get_auth_header(request)
         #token = "" #Overide token for testing
 
-        rehive = Rehive(token)
-
-        try:
-            user = rehive.user.get()
-            if "admin" not in [p['name']for p in user['permission_groups']]:
-                raise exceptions.AuthenticationFailed(_('Invalid admin user'))          
-        except APIException:
+        if not token:
             raise exceptions.AuthenticationFailed(_('Invalid user'))
 
-        try:
-            company = Company.objects.get(identifier=user['company'])
-        except Company.DoesNotExist:
-            raise exceptions.AuthenticationFailed(
-                _("Inactive company. Please activate the company first."))
+        return self.introspect(token), token
 
-        user, created = User.objects.get_or_create(
-            identifier=uuid.UUID(user['identifier']).hex,
-            company=company)
 
-        # Return the permanent token for (not the request token) the company.
-        return user, company.admin.token
-
-
-class UserAuthentication(HeaderAuthentication):
+class AdminAuthentication(TokenAuthentication):
     """
-    Authentication for users.
+    Authentication for admin users.
     """
 
-    def authenticate(self, request):
-        token = self.get_auth_header(request)
-        #token = "" #Overide token for testing
- 
-        rehive = Rehive(token)
+    inactive_company_message = _(
+        "Inactive company. Please activate the company first.")
 
-        try:
-            user = rehive.user.get()        
-        except APIException:
-            raise exceptions.AuthenticationFailed(_('Invalid user'))
+    def check_user(self, rehive_user):
+        if "admin" not in rehive_user['permission_groups']:
+            raise exceptions.AuthenticationFailed(_('Invalid admin user'))
 
-        try:
-            company = Company.objects.get(identifier=user['company'])
-        except Company.DoesNotExist:
-            raise exceptions.AuthenticationFailed(_("Inactive company."))
+    def authenticate(self, request):
+        user, token = super(AdminAuthentication, self).authenticate(request)
+
+        # Return the permanent token for (not the request token) the company.
+        return user, user.company.admin.token
 
-        user, created = User.objects.get_or_create(
-            identifier=uuid.UUID(user['identifier']).hex,
-            company=company)
 
-        return user, token
+class UserAuthentication(TokenAuthentication):
+    """
+    Authentication for users.
+    """
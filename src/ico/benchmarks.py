@@ -0,0 +1,92 @@
+"""
+Timing benchmarks. They are not part of the test suite because wall clock
+times depend on the machine, run them explicitly with:
+
+    python manage.py test ico.benchmarks
+"""
+
+import timeit
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from ico import rates
+from ico.enums import IcoStatus
+from ico.models import Ico, Phase
+from ico.utils import cache as response_cache
+from ico.tests import (
+    LOCMEM_CACHES, create_company, create_ico, linear_get_phase
+)
+
+
+def report(name, seconds, number):
+    print('{:<40} {:>10.2f} ms'.format(name, seconds * 1000 / number))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IcoListBenchmark(TestCase):
+    """
+    Latency of the ICO lists per page size, with 250 ICOs of 3 phases.
+    """
+
+    number = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = create_company(currencies=2)
+        for i in range(250):
+            create_ico(cls.company, phases=3, status=IcoStatus.CLOSED)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.company.admin)
+
+    def benchmark_pages(self, url):
+        print()
+        for page_size in (10, 50, 250):
+            def get():
+                # Time the uncached responses.
+                rates.cache.clear()
+                response_cache._local_versions.clear()
+                response_cache._local_responses.clear()
+                self.client.get(url, {'page_size': page_size})
+
+            get()
+            report('{} page_size={}'.format(url, page_size),
+                min(timeit.repeat(get, number=self.number, repeat=3)),
+                self.number)
+
+    def test_ico_list(self):
+        self.benchmark_pages('/api/icos/')
+
+    def test_admin_ico_list(self):
+        self.benchmark_pages('/api/admin/icos/')
+
+    def test_user_ico_list(self):
+        self.benchmark_pages('/api/user/icos/')
+
+
+class IcoPhaseBenchmark(TestCase):
+    """
+    Active phase lookup by bisecting the phase table, compared to walking
+    the phases loaded from the database.
+    """
+
+    number = 200
+
+    def test_phase_lookup(self):
+        company = create_company(currencies=2)
+        ico = create_ico(company, phases=4, amount=Decimal(7))
+        ico = Ico.objects.get(id=ico.id)
+        ico.amount_remaining = Decimal('0.5')
+
+        def linear():
+            linear_get_phase(ico, Phase.objects.filter(
+                ico=ico).order_by('level'))
+
+        print()
+        report('linear phase lookup',
+            timeit.timeit(linear, number=self.number), self.number)
+        report('bisect phase lookup',
+            timeit.timeit(ico.get_phase, number=self.number), self.number)
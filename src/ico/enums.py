@@ -25,3 +25,27 @@ class IcoStatus(Enum):
     OPEN = 'open'
     CLOSED = 'closed'
     HIDDEN = 'hidden'
+
+
+class CommandType(Enum):
+    CREDIT = 'credit'
+    PATCH = 'patch'
+
+
+class CommandStatus(Enum):
+    PENDING = 'pending'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+
+
+class TaskStatus(Enum):
+    PENDING = 'pending'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+
+
+class RollupKind(Enum):
+    ICO = 'ico'
+    PHASE = 'phase'
+    CURRENCY = 'currency'
+    MINUTE = 'minute'
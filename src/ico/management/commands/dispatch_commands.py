@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ico.models import RehiveCommand
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+class Command(BaseCommand):
+    """
+    Long running dispatcher for the Rehive commands queued by purchases.
+    """
+
+    help = "Deliver queued Rehive commands"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+            default=settings.OUTBOX_POLL_INTERVAL,
+            help="Seconds to wait when there are no commands to deliver.")
+        parser.add_argument('--once', action='store_true', default=False,
+            help="Deliver the due commands once and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+
+            try:
+                delivered = RehiveCommand.objects.dispatch()
+            except Exception as exc:
+                logger.exception(exc)
+                delivered = 0
+
+            if options['once']:
+                break
+
+            if not delivered:
+                time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ico.models import Ico
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+class Command(BaseCommand):
+    """
+    Long running folder of sharded ICO inventories. Once per interval the
+    public remaining amount of every sharded ICO is set to the total of its
+    shards.
+    """
+
+    help = "Periodically fold sharded ICO inventories"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+            default=settings.INVENTORY_FOLD_INTERVAL,
+            help="Seconds between folds.")
+        parser.add_argument('--once', action='store_true', default=False,
+            help="Fold the inventories once and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.time()
+            close_old_connections()
+
+            try:
+                Ico.objects.fold_inventory()
+            except Exception as exc:
+                logger.exception(exc)
+
+            if options['once']:
+                break
+
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ico.models import SalesRollup
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+class Command(BaseCommand):
+    """
+    Long running folder of the ICO sales rollups. Once per interval every
+    completed purchase that is not rolled up yet is added to the rollups, in
+    batches.
+    """
+
+    help = "Periodically fold completed purchases into the sales rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+            default=settings.SALES_FOLD_INTERVAL,
+            help="Seconds between folds.")
+        parser.add_argument('--batch-size', type=int,
+            default=settings.SALES_FOLD_BATCH_SIZE,
+            help="Number of purchases folded per transaction.")
+        parser.add_argument('--once', action='store_true', default=False,
+            help="Fold the pending purchases once and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.time()
+            close_old_connections()
+
+            try:
+                while SalesRollup.objects.fold(options['batch_size']) \
+                        == options['batch_size']:
+                    pass
+            except Exception as exc:
+                logger.exception(exc)
+
+            if options['once']:
+                break
+
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ico.models import WebhookTask
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+class Command(BaseCommand):
+    """
+    Long running webhook worker. Any number of workers can drain the queue
+    concurrently, events of the same ICO are still processed in order.
+    """
+
+    help = "Process queued webhook events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+            default=settings.WEBHOOK_POLL_INTERVAL,
+            help="Seconds to wait when there are no events to process.")
+        parser.add_argument('--stats-interval', type=int, default=60,
+            help="Seconds between logging the queue metrics.")
+        parser.add_argument('--once', action='store_true', default=False,
+            help="Process the due events once and exit.")
+
+    def handle(self, *args, **options):
+        logged = 0
+
+        while True:
+            close_old_connections()
+
+            try:
+                task = WebhookTask.objects.process_next()
+
+                if time.time() - logged > options['stats_interval']:
+                    logger.info("Webhook queue: {}".format(
+                        WebhookTask.objects.get_stats()))
+                    logged = time.time()
+            except Exception as exc:
+                logger.exception(exc)
+                task = None
+
+            if task is None:
+                if options['once']:
+                    break
+
+                time.sleep(options['interval'])
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ico.models import Quote
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+class Command(BaseCommand):
+    """
+    Long running reaper of expired unused quotes.
+    """
+
+    help = "Periodically delete expired unused quotes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int,
+            default=settings.QUOTE_REAP_INTERVAL,
+            help="Seconds between reaping expired quotes.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help="Number of quotes deleted per query.")
+        parser.add_argument('--once', action='store_true', default=False,
+            help="Reap the expired quotes once and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.time()
+            close_old_connections()
+
+            try:
+                total = Quote.objects.reap(options['batch_size'])
+                logger.info("Deleted {} expired quotes.".format(total))
+            except Exception as exc:
+                logger.exception(exc)
+
+            if options['once']:
+                break
+
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ico.models import Ico, SalesRollup
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the sales rollups of ICOs from their completed purchases. The
+    rollups are dropped and the purchases are folded again by the sales
+    folder, or right away with `--fold`.
+    """
+
+    help = "Rebuild the sales rollups of ICOs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ico', type=int, default=None,
+            help="Only rebuild the rollups of this ICO.")
+        parser.add_argument('--fold', action='store_true', default=False,
+            help="Fold the purchases instead of leaving it to the folder.")
+        parser.add_argument('--batch-size', type=int, default=5000,
+            help="Number of purchases folded per transaction.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("The batch size must be positive.")
+
+        icos = Ico.all_objects.order_by('id')
+        if options['ico'] is not None:
+            icos = icos.filter(id=options['ico'])
+            if not icos.exists():
+                raise CommandError("ICO does not exist.")
+
+        for ico in icos:
+            count = SalesRollup.objects.rebuild(ico)
+            self.stdout.write("Marked {} purchases of ICO {} to be "
+                "rolled up.".format(count, ico.id))
+
+        if options['fold']:
+            total = 0
+            while True:
+                count = SalesRollup.objects.fold(options['batch_size'])
+                total += count
+                if count < options['batch_size']:
+                    break
+            self.stdout.write("Folded {} purchases.".format(total))
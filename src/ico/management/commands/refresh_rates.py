@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ico.models import Rate, RateSnapshot
+from ico.utils.sessions import get_pool_stats
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+class Command(BaseCommand):
+    """
+    Long running rate refresher. Once per interval the exchange rates are
+    fetched into a new snapshot and the rates for all open phases are
+    recalculated against it in a single pass.
+    """
+
+    help = "Periodically get exchange rates and calculate ICO Rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int,
+            default=settings.RATE_REFRESH_INTERVAL,
+            help="Seconds between exchange rate refreshes.")
+        parser.add_argument('--once', action='store_true', default=False,
+            help="Refresh the rates once and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.time()
+            close_old_connections()
+
+            try:
+                self.refresh()
+            except Exception as exc:
+                logger.exception(exc)
+
+            if options['once']:
+                break
+
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
+
+    def refresh(self):
+        snapshot = RateSnapshot.objects.create_snapshot()
+        total = Rate.objects.refresh_all(snapshot)
+        RateSnapshot.objects.prune()
+
+        logger.info("Refreshed {total} rates with snapshot {snapshot}.".format(
+            total=total, snapshot=snapshot))
+        logger.info("HTTP connection pools: {}".format(get_pool_stats()))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ico.models import Ico
+
+
+class Command(BaseCommand):
+    """
+    Split the remaining tokens of an ICO across a number of shards. A count of
+    0 folds them back onto the ICO.
+    """
+
+    help = "Set the number of inventory shards of an ICO"
+
+    def add_arguments(self, parser):
+        parser.add_argument('ico_id', type=int)
+        parser.add_argument('shards', type=int)
+
+    def handle(self, *args, **options):
+        if options['shards'] < 0:
+            raise CommandError("The number of shards cannot be negative.")
+
+        try:
+            ico = Ico.all_objects.get(id=options['ico_id'])
+        except Ico.DoesNotExist:
+            raise CommandError("ICO does not exist.")
+
+        ico.set_inventory_shards(options['shards'])
+        self.stdout.write("ICO {} now has {} inventory shards.".format(
+            ico.id, options['shards']))
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:15
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0014_ratesnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='purchase',
+            index_together=set([('created', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='quote',
+            index_together=set([('created', 'id')]),
+        ),
+    ]
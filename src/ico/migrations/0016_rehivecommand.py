@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:18
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import enumfields.fields
+import ico.enums
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0015_created_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RehiveCommand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('command', enumfields.fields.EnumField(enum=ico.enums.CommandType, max_length=50)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('idempotency_key', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('status', enumfields.fields.EnumField(default='pending', enum=ico.enums.CommandStatus, max_length=50)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('purchase', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commands', to='ico.Purchase')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='rehivecommand',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:19
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import enumfields.fields
+import ico.enums
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0016_rehivecommand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('event', enumfields.fields.EnumField(enum=ico.enums.WebhookEvent, max_length=100)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('status', enumfields.fields.EnumField(default='pending', enum=ico.enums.TaskStatus, max_length=50)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ico.Company')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='webhooktask',
+            index_together=set([('status', 'next_attempt'), ('company', 'status')]),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:21
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+import ico.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0017_webhooktask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IcoShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('index', models.IntegerField()),
+                ('amount_remaining', ico.models.MoneyField(decimal_places=18, default=Decimal('0'), max_digits=28)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ico',
+            name='inventory_shards',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='icoshard',
+            name='ico',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='ico.Ico'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='icoshard',
+            unique_together=set([('ico', 'index')]),
+        ),
+    ]
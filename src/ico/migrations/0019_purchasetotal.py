@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:21
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+import ico.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0018_icoshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('purchase_count', models.IntegerField(default=0)),
+                ('token_total', ico.models.MoneyField(decimal_places=18, default=Decimal('0'), max_digits=28)),
+                ('ico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ico.Ico')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ico.User')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='purchasetotal',
+            unique_together=set([('user', 'ico')]),
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO ico_purchasetotal (created, updated, user_id, ico_id,
+                purchase_count, token_total)
+            SELECT now(), now(), q.user_id, ph.ico_id, count(DISTINCT q.id),
+                coalesce(sum(CASE WHEN p.status = 'Complete'
+                    THEN q.token_amount ELSE 0 END), 0)
+            FROM ico_purchase p
+            JOIN ico_quote q ON q.id = p.quote_id
+            JOIN ico_phase ph ON ph.id = q.phase_id
+            GROUP BY q.user_id, ph.ico_id
+            """,
+            migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:22
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0019_purchasetotal'),
+    ]
+
+    operations = [
+        # Keep only the most recent open ICO of each company open.
+        migrations.RunSQL(
+            """
+            UPDATE ico_ico SET status = 'closed'
+            WHERE status = 'open' AND NOT deleted AND id NOT IN (
+                SELECT max(id) FROM ico_ico
+                WHERE status = 'open' AND NOT deleted
+                GROUP BY company_id)
+            """,
+            migrations.RunSQL.noop),
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX ico_ico_one_open_per_company "
+            "ON ico_ico (company_id) WHERE status = 'open' AND NOT deleted",
+            "DROP INDEX ico_ico_one_open_per_company"),
+    ]
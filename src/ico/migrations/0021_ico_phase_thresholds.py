@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:23
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+def build_phase_thresholds(apps, schema_editor):
+    """
+    Build the phase table of existing ICOs, see
+    `Ico.update_phase_thresholds`.
+    """
+
+    Ico = apps.get_model('ico', 'Ico')
+    Phase = apps.get_model('ico', 'Phase')
+
+    for ico in Ico.objects.all():
+        table = []
+        percentage = 0
+        for phase in Phase.objects.filter(ico_id=ico.id).order_by('level'):
+            percentage += phase.percentage
+            table.append([str(ico.amount * percentage / 100), phase.id,
+                phase.level, phase.percentage, str(phase.base_rate)])
+
+        Ico.objects.filter(id=ico.id).update(phase_thresholds=table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0020_one_open_ico_per_company'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ico',
+            name='phase_thresholds',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(build_phase_thresholds,
+            migrations.RunPython.noop),
+    ]
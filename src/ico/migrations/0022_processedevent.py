@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import enumfields.fields
+import ico.enums
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0021_ico_phase_thresholds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('event', enumfields.fields.EnumField(enum=ico.enums.WebhookEvent, max_length=100)),
+                ('tx_id', models.CharField(max_length=200)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ico.Company')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='processedevent',
+            unique_together=set([('company', 'event', 'tx_id')]),
+        ),
+        # Record the events of existing purchases as processed.
+        migrations.RunSQL(
+            """
+            INSERT INTO ico_processedevent (created, updated, company_id,
+                event, tx_id)
+            SELECT now(), now(), u.company_id, e.event, p.deposit_tx
+            FROM ico_purchase p
+            JOIN ico_quote q ON q.id = p.quote_id
+            JOIN ico_user u ON u.id = q.user_id
+            CROSS JOIN (VALUES ('transaction.initiate'),
+                ('transaction.execute')) e (event)
+            WHERE p.deposit_tx IS NOT NULL
+            AND (e.event = 'transaction.initiate' OR p.status <> 'Pending')
+            ON CONFLICT DO NOTHING
+            """,
+            migrations.RunSQL.noop),
+    ]
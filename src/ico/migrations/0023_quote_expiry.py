@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0022_processedevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quote',
+            name='expires_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='purchased',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE ico_quote q SET expires_at = q.created + interval '10 minutes',
+                purchased = EXISTS (
+                    SELECT 1 FROM ico_purchase p WHERE p.quote_id = q.id)
+            """,
+            migrations.RunSQL.noop),
+        # Unused quote lookups at webhook time, and the quote reaper.
+        migrations.RunSQL(
+            "CREATE INDEX ico_quote_unused ON ico_quote (user_id, "
+            "deposit_currency_id, deposit_amount, phase_id, expires_at) "
+            "WHERE NOT purchased",
+            "DROP INDEX ico_quote_unused"),
+        migrations.RunSQL(
+            "CREATE INDEX ico_quote_unused_expires_at ON ico_quote "
+            "(expires_at) WHERE NOT purchased",
+            "DROP INDEX ico_quote_unused_expires_at"),
+    ]
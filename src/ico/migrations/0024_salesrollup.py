@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:27
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+import enumfields.fields
+import ico.enums
+import ico.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0023_quote_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('kind', enumfields.fields.EnumField(enum=ico.enums.RollupKind, max_length=50)),
+                ('key', models.CharField(blank=True, max_length=50)),
+                ('bucket', models.DateTimeField(blank=True, null=True)),
+                ('purchase_count', models.IntegerField(default=0)),
+                ('token_total', ico.models.MoneyField(decimal_places=18, default=Decimal('0'), max_digits=28)),
+                ('deposit_total', ico.models.MoneyField(decimal_places=18, default=Decimal('0'), max_digits=28)),
+                ('currency', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='ico.Currency')),
+                ('ico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='ico.Ico')),
+                ('phase', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='ico.Phase')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='salesrollup',
+            unique_together=set([('ico', 'kind', 'key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='salesrollup',
+            index_together=set([('ico', 'kind', 'bucket')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.7 on 2026-10-17 02:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ico', '0024_salesrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='completed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='rolled_up',
+            field=models.BooleanField(default=False),
+        ),
+        # Rollups are rebuilt by the sales folder from the completion times,
+        # existing purchases only have their last update time.
+        migrations.RunSQL(
+            """
+            UPDATE ico_purchase SET completed = updated
+                WHERE status = 'Complete';
+            DELETE FROM ico_salesrollup;
+            """,
+            migrations.RunSQL.noop),
+        # Completed purchases waiting for the sales folder.
+        migrations.RunSQL(
+            "CREATE INDEX ico_purchase_unrolled ON ico_purchase (id) "
+            "WHERE status = 'Complete' AND NOT rolled_up",
+            "DROP INDEX ico_purchase_unrolled"),
+    ]
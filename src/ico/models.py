@@ -1,23 +1,33 @@
+import bisect
 import datetime
 import uuid
 from enumfields import EnumField
-from decimal import Decimal
+from decimal import Decimal, ROUND_DOWN
 
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Case, When, Value
+from django.conf import settings
+from django.utils import timezone
 from django.utils.timezone import utc
 from django.db.models.functions import Coalesce
-from django.db import transaction
+from django.db import transaction, connection, IntegrityError
 from django.contrib.postgres.fields import JSONField
 from rest_framework.exceptions import ValidationError
-from rehive import Rehive
 
 from ico.exceptions import SilentException, PurchaseException
-from ico.enums import PurchaseStatus, IcoStatus
-from ico.rates import get_crypto_rates, get_fiat_rates
+from ico.enums import (
+    PurchaseStatus, IcoStatus, CommandType, CommandStatus, WebhookEvent,
+    TaskStatus, RollupKind
+)
+from ico.rates import (
+    get_crypto_rates, get_fiat_rates, fetch_crypto_rates, fetch_fiat_rates,
+    exchange_code, RateMatrix
+)
 from ico.utils.common import (
     to_cents, from_cents
 )
+from ico.utils.cache import bump_ico_versions
+from ico.utils.sessions import get_rehive
 
 from logging import getLogger
 
@@ -100,6 +110,33 @@ class IcoManager(models.Manager):
             .get_queryset()\
             .filter(deleted=False)
 
+    def fold_inventory(self):
+        """
+        Update the public `amount_remaining` of ICOs with a sharded inventory
+        to the total of their shards, in a single statement. ICOs that were
+        unsharded in the meantime are skipped, their `amount_remaining` is
+        authoritative again. Returns the number of ICOs changed.
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE {ico} SET amount_remaining = shards.total, "
+                "updated = %s "
+                "FROM (SELECT ico_id, SUM(amount_remaining) AS total "
+                "FROM {shard} GROUP BY ico_id) AS shards "
+                "WHERE shards.ico_id = {ico}.id "
+                "AND {ico}.inventory_shards > 0 "
+                "AND {ico}.amount_remaining <> shards.total "
+                "RETURNING {ico}.id".format(
+                    ico=Ico._meta.db_table, shard=IcoShard._meta.db_table),
+                [datetime.datetime.now(tz=utc)])
+            ico_ids = [row[0] for row in cursor.fetchall()]
+
+        if ico_ids:
+            bump_ico_versions(*ico_ids)
+
+        return len(ico_ids)
+
 
 class Ico(DateModel):
     company = models.ForeignKey('ico.Company')
@@ -115,43 +152,235 @@ class Ico(DateModel):
     status = EnumField(IcoStatus, max_length=50, default=IcoStatus.HIDDEN)
     public = models.BooleanField(default=False)
     deleted = models.BooleanField(default=False)
+    # Number of IcoShard rows the remaining tokens are split across, 0 keeps
+    # them on the ICO row itself.
+    inventory_shards = models.IntegerField(default=0)
+    # Phase table maintained by `update_phase_thresholds`.
+    phase_thresholds = JSONField(null=True, blank=True)
 
     objects = IcoManager()
     all_objects = models.Manager()
 
+    # Fields that are only changed with atomic updates or `set_status`, saving
+    # an ICO must not overwrite them with the values it was loaded with.
+    atomic_fields = ('amount_remaining', 'inventory_shards', 'status',)
+
     def save(self, *args, **kwargs):
         # Set initial balance for the ICO.
         if not self.id:
             self.amount_remaining = self.amount
+            self.phase_thresholds = []
+        elif not kwargs.get('update_fields'):
+            # The thresholds depend on the amount.
+            self.update_phase_thresholds(save=False)
+            kwargs['update_fields'] = [field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.atomic_fields]
+
+        result = super(Ico, self).save(*args, **kwargs)
+        bump_ico_versions(self.id)
+        return result
 
-        if self.status == IcoStatus.OPEN:
-            Ico.objects.filter(company=self.company, 
-                status=IcoStatus.OPEN).update(status=IcoStatus.CLOSED)
+    @transaction.atomic()
+    def set_status(self, status):
+        """
+        Change the status of the ICO. Opening an ICO closes the other open ICO
+        of the company, only one ICO per company can be open.
+        """
+
+        # Serialize status changes per company.
+        Company.objects.select_for_update().get(id=self.company_id)
+
+        if status == IcoStatus.OPEN:
+            open_icos = Ico.objects.filter(company_id=self.company_id,
+                status=IcoStatus.OPEN).exclude(id=self.id)
+            bump_ico_versions(*open_icos.values_list('id', flat=True))
+            open_icos.update(status=IcoStatus.CLOSED,
+                updated=datetime.datetime.now(tz=utc))
 
-        return super(Ico, self).save(*args, **kwargs)
+        self.status = status
+        self.save(update_fields=('status', 'updated',))
 
     def __str__(self):
         return str(self.currency) + "_" + str(self.company)
 
+    def update_phase_thresholds(self, save=True):
+        """
+        Rebuild the phase table. Each row holds the amount of tokens sold at
+        which a phase ends, in level order, along with the phase fields.
+        """
+
+        table = []
+        percentage = 0
+        for phase in Phase.objects.filter(ico_id=self.id).order_by('level'):
+            percentage += phase.percentage
+            table.append([str(self.amount * percentage / 100), phase.id,
+                phase.level, phase.percentage, str(phase.base_rate)])
+
+        self.phase_thresholds = table
+        self._phase_bounds = None
+
+        if save:
+            Ico.all_objects.filter(id=self.id).update(phase_thresholds=table,
+                updated=datetime.datetime.now(tz=utc))
+            bump_ico_versions(self.id)
+
     def get_phase(self):
-        if self.amount_remaining > 0:
-            # Percent already sold.
-            perc = ((self.amount - self.amount_remaining) / self.amount) * 100
+        """
+        Get the active phase by bisecting the phase table with the amount of
+        tokens sold. The phase is built from the table without a query.
+        """
 
-            for phase in Phase.objects.filter(ico=self).order_by('level'):
-                if perc < phase.percentage:
-                    return phase
-                else:
-                    perc = perc - phase.percentage
+        if self.amount_remaining > 0 and self.phase_thresholds:
+            if getattr(self, '_phase_bounds', None) is None:
+                self._phase_bounds = [Decimal(row[0])
+                    for row in self.phase_thresholds]
+
+            index = bisect.bisect_right(self._phase_bounds,
+                self.amount - self.amount_remaining)
+
+            if index < len(self.phase_thresholds):
+                threshold, phase_id, level, percentage, base_rate = \
+                    self.phase_thresholds[index]
+                phase = Phase(id=phase_id, ico_id=self.id, level=level,
+                    percentage=percentage, base_rate=Decimal(base_rate))
+                phase.ico = self
+                return phase
 
         raise Phase.DoesNotExist
 
-    def deduct_amount(self, amount):
-        if (self.amount_remaining - amount) < 0:
+    def deduct_amount(self, amount, key=0):
+        """
+        Atomically deduct an amount from the remaining tokens. The row is only
+        updated if enough tokens remain, so concurrent purchases never
+        oversell the ICO and do not have to lock it.
+
+        ICOs with a sharded inventory deduct from the shard selected by the
+        key instead, see `deduct_shard_amount`.
+        """
+
+        if self.inventory_shards:
+            return self.deduct_shard_amount(amount, key)
+
+        deducted = Ico.all_objects.filter(id=self.id, inventory_shards=0,
+            amount_remaining__gte=amount).update(
+                amount_remaining=F('amount_remaining') - amount,
+                updated=datetime.datetime.now(tz=utc))
+
+        if not deducted:
+            # The inventory may have been sharded in the meantime.
+            self.inventory_shards = Ico.all_objects.filter(
+                id=self.id).values_list('inventory_shards', flat=True)[0]
+            if self.inventory_shards:
+                return self.deduct_shard_amount(amount, key)
+
             raise PurchaseException("All ICO tokens have been sold.")
 
+        # Concurrent purchases may have deducted more in the meantime.
         self.amount_remaining = self.amount_remaining - amount
-        self.save()
+        bump_ico_versions(self.id)
+
+    def deduct_shard_amount(self, amount, key=0):
+        """
+        Deduct an amount from the sharded inventory. Purchases are routed to
+        a shard by key so that concurrent purchases update different rows.
+        If no shard holds enough tokens on its own, all shards are locked and
+        the remaining tokens are rebalanced across them.
+
+        The public `amount_remaining` is only updated when the shards are
+        folded, see `IcoManager.fold_inventory`.
+        """
+
+        if not self.inventory_shards:
+            return self.deduct_amount(amount, key)
+
+        shards = IcoShard.objects.filter(ico_id=self.id)
+        start = key % self.inventory_shards
+        order = list(range(start, self.inventory_shards)) + \
+            list(range(0, start))
+
+        for index in order:
+            if shards.filter(index=index, amount_remaining__gte=amount)\
+                    .update(amount_remaining=F('amount_remaining') - amount):
+                return
+
+        # The shard count may have changed since the ICO was loaded. Lock the
+        # ICO before its shards, like `set_inventory_shards`, so the count
+        # cannot change until the shards are rebalanced.
+        self.inventory_shards = Ico.all_objects.select_for_update().filter(
+            id=self.id).values_list('inventory_shards', flat=True)[0]
+        if not self.inventory_shards:
+            return self.deduct_amount(amount, key)
+
+        locked = list(shards.select_for_update().order_by('index'))
+        total = sum(shard.amount_remaining for shard in locked)
+
+        if total < amount:
+            raise PurchaseException("All ICO tokens have been sold.")
+
+        for shard, value in zip(locked, split_amount(
+                total - amount, len(locked))):
+            shard.amount_remaining = value
+            shard.save(update_fields=('amount_remaining', 'updated',))
+
+    @transaction.atomic()
+    def set_inventory_shards(self, count):
+        """
+        Split the remaining tokens across a number of shards, or fold them
+        back onto the ICO row if the count is 0.
+        """
+
+        ico = Ico.all_objects.select_for_update().get(id=self.id)
+        shards = list(IcoShard.objects.select_for_update().filter(ico=ico))
+
+        if ico.inventory_shards:
+            ico.amount_remaining = sum(
+                shard.amount_remaining for shard in shards) or Decimal(0)
+        IcoShard.objects.filter(ico=ico).delete()
+
+        IcoShard.objects.bulk_create([
+            IcoShard(ico=ico, index=index, amount_remaining=value,
+                created=datetime.datetime.now(tz=utc),
+                updated=datetime.datetime.now(tz=utc))
+            for index, value in enumerate(
+                split_amount(ico.amount_remaining, count))])
+
+        Ico.all_objects.filter(id=ico.id).update(
+            inventory_shards=count,
+            amount_remaining=ico.amount_remaining,
+            updated=datetime.datetime.now(tz=utc))
+        bump_ico_versions(ico.id)
+
+        self.inventory_shards = count
+        self.amount_remaining = ico.amount_remaining
+
+
+def split_amount(amount, count):
+    """
+    Split an amount into a number of slices with the same scale as a
+    MoneyField. The remainder is added to the first slice.
+    """
+
+    if not count:
+        return []
+
+    quantum = Decimal(10) ** -18
+    value = (amount / count).quantize(quantum, rounding=ROUND_DOWN)
+    return [amount - value * (count - 1)] + [value] * (count - 1)
+
+
+class IcoShard(DateModel):
+    """
+    Slice of the remaining tokens of an ICO with a sharded inventory.
+    """
+
+    ico = models.ForeignKey('ico.Ico', related_name='shards')
+    index = models.IntegerField()
+    amount_remaining = MoneyField(default=Decimal(0))
+
+    class Meta:
+        unique_together = (('ico', 'index'),)
 
 
 class PhaseManager(models.Manager):
@@ -175,125 +404,299 @@ class Phase(DateModel):
         return str(self.level)
 
 
+class RateSnapshotManager(models.Manager):
+
+    def create_snapshot(self):
+        """
+        Fetch the latest rates from the exchange and store them as a new
+        snapshot.
+        """
+
+        return self.create(fiat_rates=fetch_fiat_rates(),
+            crypto_rates=fetch_crypto_rates())
+
+    def current(self):
+        """
+        Get the latest snapshot. If no snapshot exists yet, one is created
+        from the cached exchange rates.
+        """
+
+        try:
+            return self.latest('id')
+        except RateSnapshot.DoesNotExist:
+            return self.create(fiat_rates=get_fiat_rates(),
+                crypto_rates=get_crypto_rates())
+
+    def prune(self, keep=10):
+        """
+        Delete old snapshots that are no longer referenced by any rates.
+        """
+
+        latest = self.order_by('-id').values_list('id', flat=True)[:keep]
+        return self.exclude(id__in=list(latest)).exclude(
+            id__in=Rate.objects.filter(snapshot__isnull=False).values(
+                'snapshot')).delete()
+
+
+class RateSnapshot(DateModel):
+    """
+    A versioned copy of the exchange rates. The snapshot id is the version
+    that rates were calculated with.
+    """
+
+    fiat_rates = JSONField(default=dict)
+    crypto_rates = JSONField(default=dict)
+
+    objects = RateSnapshotManager()
+
+    def __str__(self):
+        return str(self.id)
+
+    def get_matrix(self, codes):
+        """
+        Build the cross rate matrix of the snapshot for the currency codes.
+        """
+
+        return RateMatrix(self.fiat_rates, self.crypto_rates, codes)
+
+
 class RateManager(models.Manager):
 
-    def get(self, *args, **kwargs):
-        obj = super(RateManager, self).get(*args, **kwargs)
-        obj.refresh_rate()
-        return obj
+    def refresh(self, *args, **kwargs):
+        """
+        Recalculate and store all rates matching the lookup arguments.
+
+        Reading rates never recalculates them, this is the explicit refresh
+        path used by the rate pipeline.
+        """
+
+        snapshot = RateSnapshot.objects.current()
+        rates = list(self.filter(*args, **kwargs).select_related('currency',
+            'phase__ico__currency', 'phase__ico__base_currency'))
+        matrix = snapshot.get_matrix(set(rate.currency.code for rate in rates)
+            | set(rate.phase.ico.base_currency.code for rate in rates))
+
+        for rate in rates:
+            rate.refresh_rate(snapshot, matrix)
+        return rates
+
+    def refresh_all(self, snapshot, batch_size=500):
+        """
+        Calculate the rates for every phase of every open ICO against a
+        snapshot in a single pass. A cross rate matrix is built for all
+        currencies of the companies involved, existing rates are written with
+        bulk updates and missing rates are created in bulk.
+        """
+
+        phases = list(Phase.objects.filter(ico__status=IcoStatus.OPEN,
+            ico__deleted=False).select_related('ico__currency',
+                'ico__base_currency'))
+
+        currencies = {}
+        for currency in Currency.objects.filter(
+                company__in=set(phase.ico.company_id for phase in phases)):
+            currencies.setdefault(currency.company_id, []).append(currency)
+
+        matrix = snapshot.get_matrix(set(currency.code
+            for company_currencies in currencies.values()
+            for currency in company_currencies))
+
+        existing = {}
+        for rate in self.filter(phase__in=phases).select_related('currency',
+                'phase__ico__currency', 'phase__ico__base_currency'):
+            existing[(rate.phase_id, rate.currency_id)] = rate
+
+        now = datetime.datetime.now(tz=utc)
+        updates = {}
+        new_rates = []
+
+        for phase in phases:
+            for currency in currencies.get(phase.ico.company_id, []):
+                rate = existing.get((phase.id, currency.id))
+                if rate is None:
+                    rate = Rate(phase=phase, currency=currency)
+
+                value = rate._calculate_rate(matrix)
+                if value is None:
+                    logger.info("No exchange rate available for {}.".format(
+                        currency))
+                    continue
+
+                if rate.id:
+                    updates[rate.id] = value
+                else:
+                    rate.rate = value
+                    rate.snapshot = snapshot
+                    rate.created = now
+                    rate.updated = now
+                    new_rates.append(rate)
+
+        self.bulk_create(new_rates, batch_size=batch_size)
+
+        rate_ids = list(updates)
+        for i in range(0, len(rate_ids), batch_size):
+            batch = rate_ids[i:i + batch_size]
+            self.filter(id__in=batch).update(
+                rate=Case(
+                    *[When(id=rate_id, then=Value(updates[rate_id],
+                        output_field=MoneyField())) for rate_id in batch],
+                    output_field=MoneyField()),
+                snapshot=snapshot,
+                updated=now)
 
-    def filter(self, *args, **kwargs):
-        queryset = super(RateManager, self).filter(*args, **kwargs)
-        for rate in queryset:
-            rate.refresh_rate()
-        return queryset
+        return len(new_rates) + len(updates)
 
 
 class Rate(DateModel):
     phase = models.ForeignKey('ico.Phase')
     currency = models.ForeignKey('ico.Currency')
     rate = MoneyField(default=Decimal(0))
+    snapshot = models.ForeignKey('ico.RateSnapshot', null=True, blank=True,
+        on_delete=models.SET_NULL)
 
     objects = RateManager()
 
-    def __init__(self, *args, **kwargs):
-        super(Rate, self).__init__(*args, **kwargs)
-        self._currency_code = self.currency.code
-        self._ico_base_currency_code = self.phase.ico.base_currency.code
-        self._convert_xbt_currency_code()
-
-    def _convert_xbt_currency_code(self):
+    @property
+    def _currency_code(self):
         """
-        Convert the Bitcoin currency code from XBT to BTC.
-        The exchange uses BTC instead of the proper XBT code.
+        The exchange code of the rate currency, the exchange uses BTC instead
+        of the proper XBT code.
         """
-        if self._currency_code == 'XBT':
-            self._currency_code = 'BTC'
-
-        if self._ico_base_currency_code == 'XBT':
-            self._ico_base_currency_code = 'BTC'
-
-    def _calculate_crypto_rate(self):
+        return exchange_code(self.currency.code)
 
-        # Get the updated rates from the exchange or caches
-        crypto_rates = get_crypto_rates()
-
-        # For crypto currencies the rates are listed in
-        # currency pairs (symbols), in which case we would need to
-        # check them both ways because they are only listed
-        # in one "direction"
-        symbol = self._currency_code + self._ico_base_currency_code
-        reverse_symbol = self._ico_base_currency_code + self._currency_code
-        check_reverse = False
-
-        try:
-            # "Forward" checking of the rates symbol. If it
-            # matches do the normal rate calculation
-            if not symbol.startswith('BTC'):
-                # Bitcoin is treated as a fiat currency by the exchange
-                crypto_rate = Decimal(crypto_rates[symbol]['last'])
-                return (1 / crypto_rate) * self.phase.base_rate
-        except KeyError:
-            check_reverse = True
-
-        if check_reverse:
-            try:
-                # "Backwards" checking on the rates symbol. If it
-                # matches do the inverse rate calculation
-                crypto_rate = Decimal(crypto_rates[reverse_symbol]['last'])
-                return crypto_rate * self.phase.base_rate
-            except KeyError:
-                # TODO: Call CONVERT api endpoint
-                pass
-
-    def _calculate_rate(self):
-        """
-        Calculate the rate based on the most recent rates data
-        from the exchange. Calculations are done with relation to the
-        ICO currency itself, or USD.
-
-        All exchange fiat rates are USD based which, going forward, will be
-        referred to as "forward" rates and the inverse as the "backwards" rate.
-        Eg.
-            Forward: USD -> EUR
-            Backward: EUR -> USD
+    @property
+    def _ico_base_currency_code(self):
+        """
+        The exchange code of the ICO base currency.
+        """
+        return exchange_code(self.phase.ico.base_currency.code)
 
-        The same is done with crypto currency pairs (symbols), which are only
-        listed in one direction.
+    def _calculate_rate(self, matrix):
+        """
+        Calculate the rate based on the cross rate matrix of an exchange rate
+        snapshot. Calculations are done with relation to the ICO base
+        currency, the matrix already resolves fiat rates through USD and
+        crypto currency pairs (symbols) in either direction or through
+        multiple pairs.
         Eg.
-            Forward: ETHBTC
-            Backward: BTCETH
+            Fiat: EUR -> USD -> ZAR
+            Crypto: USD -> BTC -> ETH
         """
 
         # The ICO currency is worth one of itself
-        if self.currency == self.phase.ico.currency:
+        if self.currency_id == self.phase.ico.currency_id:
             return 1
 
         # This is the rate set in the phase so already has the proper rate
-        if self.currency == self.phase.ico.base_currency:
+        if self.currency_id == self.phase.ico.base_currency_id:
             return self.phase.base_rate
 
-        # Get the updated rates from the exchange or caches
-        fiat_rates = get_fiat_rates()
+        conversion = matrix.get(self._ico_base_currency_code,
+            self._currency_code)
 
-        try:
-            base_rate = Decimal(fiat_rates[self._ico_base_currency_code]['rate'])
-            exchange_rate = Decimal(fiat_rates[self._currency_code]['rate'])
-        except KeyError as exc:
-            return self._calculate_crypto_rate()
+        if conversion is not None:
+            return conversion * self.phase.base_rate
+
+    @property
+    def as_of(self):
+        """
+        The time of the exchange rates the stored rate was calculated with.
+        """
+
+        if self.snapshot_id:
+            return self.snapshot.created
+        return self.updated
+
+    def refresh_rate(self, snapshot=None, matrix=None):
+        """
+        Recalculate and store the rate. Returns False without storing anything
+        if the snapshot has no conversion to the currency, an unsaved rate is
+        then not created.
+        """
+
+        if snapshot is None:
+            snapshot = RateSnapshot.objects.current()
+
+        if matrix is None:
+            matrix = snapshot.get_matrix(
+                (self._currency_code, self._ico_base_currency_code,))
+
+        value = self._calculate_rate(matrix)
+        if value is None:
+            logger.info("No exchange rate available for {}.".format(
+                self.currency))
+            return False
+
+        self.rate = value
+        self.snapshot = snapshot
+        if self.id:
+            self.save(update_fields=('rate', 'snapshot', 'updated',))
         else:
-            if self.phase.ico.base_currency.code == 'USD':
-                # "Forward" checking of the rates symbol since they
-                # are USD based. Do the normal rate calculation.
-                return (base_rate * exchange_rate) * self.phase.base_rate
-            else:
-                # Inverse calculation to get the rate with
-                # relation to USD.
-                return ((1 / base_rate) * exchange_rate) * self.phase.base_rate
+            self.save()
+        return True
 
-    def refresh_rate(self):
-        self.rate = self._calculate_rate()
-        self.save()
+
+class QuoteManager(models.Manager):
+
+    def create_bulk(self, quotes):
+        """
+        Create quotes with a single insert.
+        """
+
+        if not quotes:
+            return quotes
+
+        # Reserve the ids up front, bulk inserts do not return them.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                "FROM generate_series(1, %s)",
+                [self.model._meta.db_table, len(quotes)])
+            ids = [row[0] for row in cursor.fetchall()]
+
+        now = datetime.datetime.now(tz=utc)
+        for quote, quote_id in zip(quotes, ids):
+            quote.id = quote_id
+            quote.created = now
+            quote.updated = now
+            quote.expires_at = now + datetime.timedelta(
+                seconds=settings.QUOTE_TTL)
+
+        self.bulk_create(quotes)
+        return quotes
+
+    def get_unused(self, user, phase, deposit_currency, deposit_amount):
+        """
+        Get the most recent unexpired and unused quote matching a deposit.
+        """
+
+        return self.filter(
+            user=user,
+            phase=phase,
+            deposit_currency=deposit_currency,
+            deposit_amount=deposit_amount,
+            purchased=False,
+            expires_at__gt=datetime.datetime.now(tz=utc)
+        ).order_by('-expires_at').first()
+
+    def reap(self, batch_size=1000):
+        """
+        Delete unused quotes that expired longer than QUOTE_REAP_GRACE seconds
+        ago, in batches. Returns the number of quotes deleted.
+        """
+
+        expired = datetime.datetime.now(tz=utc) - datetime.timedelta(
+            seconds=settings.QUOTE_REAP_GRACE)
+        total = 0
+
+        while True:
+            ids = list(self.filter(purchased=False, expires_at__lt=expired)\
+                .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return total
+
+            self.filter(id__in=ids, purchased=False).delete()
+            total += len(ids)
 
 
 class Quote(DateModel):
@@ -303,19 +706,231 @@ class Quote(DateModel):
     deposit_currency = models.ForeignKey('ico.Currency')
     token_amount = MoneyField(default=Decimal(0))
     rate = MoneyField(default=Decimal(0))  # Rate of conversion between deposit currency and 1 token at time of quote.
+    expires_at = models.DateTimeField()
+    purchased = models.BooleanField(default=False)
+
+    objects = QuoteManager()
+
+    class Meta:
+        index_together = (('created', 'id'),)
 
     def save(self, *args, **kwargs):
-        # Delete all previous quotes for the same currency and phase.
         if not self.id:
-            Quote.objects.filter(user=self.user,
-                phase=self.phase, 
-                deposit_amount=self.deposit_amount,
-                deposit_currency=self.deposit_currency,
-                purchase=None).delete()
+            self.expires_at = datetime.datetime.now(tz=utc) + \
+                datetime.timedelta(seconds=settings.QUOTE_TTL)
 
         return super(Quote, self).save(*args, **kwargs)
 
 
+class PurchaseTotalManager(models.Manager):
+
+    def increment(self, user_id, ico_id, purchases=0, tokens=Decimal(0)):
+        """
+        Add to the purchase totals of a user for an ICO.
+        """
+
+        values = {
+            'purchase_count': F('purchase_count') + purchases,
+            'token_total': F('token_total') + tokens,
+            'updated': datetime.datetime.now(tz=utc),
+        }
+
+        if self.filter(user_id=user_id, ico_id=ico_id).update(**values):
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(user_id=user_id, ico_id=ico_id,
+                    purchase_count=purchases, token_total=tokens)
+        except IntegrityError:
+            # Created by a concurrent purchase.
+            self.filter(user_id=user_id, ico_id=ico_id).update(**values)
+
+    def get_count(self, user, ico):
+        """
+        Get the number of purchases a user made for an ICO.
+        """
+
+        count = self.filter(user=user, ico=ico).values_list(
+            'purchase_count', flat=True).first()
+        return count or 0
+
+
+class PurchaseTotal(DateModel):
+    """
+    Number of purchases and total tokens bought per user and ICO, maintained
+    along with the purchases.
+    """
+
+    user = models.ForeignKey('ico.User')
+    ico = models.ForeignKey('ico.Ico')
+    purchase_count = models.IntegerField(default=0)
+    token_total = MoneyField(default=Decimal(0))
+
+    objects = PurchaseTotalManager()
+
+    class Meta:
+        unique_together = (('user', 'ico'),)
+
+
+class SalesRollupManager(models.Manager):
+
+    def add(self, rows):
+        """
+        Add purchase counts and totals to rollup rows with a single upsert.
+        Rows are tuples of (ico_id, kind, phase_id, currency_id, bucket,
+        purchase_count, token_total, deposit_total).
+        """
+
+        if not rows:
+            return
+
+        now = datetime.datetime.now(tz=utc)
+        values = []
+        params = []
+        for (ico_id, kind, phase_id, currency_id, bucket, count, tokens,
+                deposits) in rows:
+            key = {
+                RollupKind.ICO: '',
+                RollupKind.PHASE: str(phase_id),
+                RollupKind.CURRENCY: str(currency_id),
+                RollupKind.MINUTE: bucket.isoformat() if bucket else '',
+            }[kind]
+            values.append("(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+            params.extend([now, now, ico_id, kind.value, key, phase_id,
+                currency_id, bucket, count, tokens, deposits])
+
+        table = self.model._meta.db_table
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {table} (created, updated, ico_id, kind, key, "
+                "phase_id, currency_id, bucket, purchase_count, token_total, "
+                "deposit_total) VALUES {values} "
+                "ON CONFLICT (ico_id, kind, key) DO UPDATE SET "
+                "purchase_count = {table}.purchase_count "
+                "+ EXCLUDED.purchase_count, "
+                "token_total = {table}.token_total + EXCLUDED.token_total, "
+                "deposit_total = {table}.deposit_total "
+                "+ EXCLUDED.deposit_total, "
+                "updated = EXCLUDED.updated".format(
+                    table=table, values=', '.join(values)),
+                params)
+
+    @transaction.atomic()
+    def fold(self, batch_size=1000):
+        """
+        Add a batch of completed purchases that are not rolled up yet to the
+        ICO, phase, deposit currency and minute rollups of their ICOs.
+        Purchases are claimed with SKIP LOCKED so that concurrent folders
+        work on different batches. Returns the number of purchases folded.
+
+        Rollups are only written here, completions never wait on the rollup
+        rows.
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM {table} WHERE status = %s "
+                "AND rolled_up = false ORDER BY id LIMIT %s "
+                "FOR UPDATE SKIP LOCKED".format(
+                    table=Purchase._meta.db_table),
+                [PurchaseStatus.COMPLETE.value, batch_size])
+            ids = [row[0] for row in cursor.fetchall()]
+
+        if not ids:
+            return 0
+
+        totals = {}
+
+        def add(key, tokens, deposits):
+            purchase_count, token_total, deposit_total = totals.get(
+                key, (0, Decimal(0), Decimal(0)))
+            totals[key] = (purchase_count + 1, token_total + tokens,
+                deposit_total + deposits)
+
+        for (completed, ico_id, phase_id, currency_id, tokens,
+                deposits) in Purchase.objects.filter(id__in=ids).values_list(
+                    'completed', 'quote__phase__ico_id', 'quote__phase_id',
+                    'quote__deposit_currency_id', 'quote__token_amount',
+                    'quote__deposit_amount'):
+            bucket = completed.replace(second=0, microsecond=0)
+            add((ico_id, RollupKind.ICO, None, None, None), tokens,
+                Decimal(0))
+            add((ico_id, RollupKind.PHASE, phase_id, None, None), tokens,
+                Decimal(0))
+            add((ico_id, RollupKind.CURRENCY, None, currency_id, None),
+                tokens, deposits)
+            add((ico_id, RollupKind.MINUTE, None, None, bucket), tokens,
+                Decimal(0))
+
+        # Upsert in a fixed order so that concurrent folders do not deadlock.
+        self.add(sorted((key + value for key, value in totals.items()),
+            key=lambda row: (row[0], row[1].value, row[2] or 0, row[3] or 0,
+                row[4].timestamp() if row[4] else 0)))
+
+        Purchase.objects.filter(id__in=ids).update(rolled_up=True)
+        return len(ids)
+
+    @transaction.atomic()
+    def rebuild(self, ico):
+        """
+        Drop the rollups of an ICO and mark its completed purchases to be
+        folded again. Returns the number of purchases marked.
+        """
+
+        # Mark the purchases first, this waits for folders that hold them.
+        count = Purchase.objects.filter(quote__phase__ico=ico,
+            status=PurchaseStatus.COMPLETE).update(rolled_up=False)
+        self.filter(ico=ico).delete()
+        return count
+
+    def get_series(self, ico, period, start=None, end=None):
+        """
+        Get the purchase counts and token totals of an ICO per minute, hour
+        or day, from the minute rollups.
+        """
+
+        queryset = self.filter(ico=ico, kind=RollupKind.MINUTE)
+        if start:
+            queryset = queryset.filter(bucket__gte=start)
+        if end:
+            queryset = queryset.filter(bucket__lt=end)
+
+        return queryset.extra(
+            select={'period': "date_trunc(%s, bucket)"},
+            select_params=(period,)
+        ).values('period').annotate(
+            purchase_count=models.Sum('purchase_count'),
+            token_total=models.Sum('token_total')
+        ).order_by('period')
+
+
+class SalesRollup(DateModel):
+    """
+    Purchase count and totals of the completed purchases of an ICO, per ICO,
+    phase, deposit currency or minute of completion. Completed purchases are
+    added by the sales folder, see `SalesRollupManager.fold`.
+    """
+
+    ico = models.ForeignKey('ico.Ico', related_name='sales')
+    kind = EnumField(RollupKind, max_length=50)
+    key = models.CharField(max_length=50, blank=True)
+    phase = models.ForeignKey('ico.Phase', null=True, blank=True)
+    currency = models.ForeignKey('ico.Currency', null=True, blank=True)
+    bucket = models.DateTimeField(null=True, blank=True)
+    purchase_count = models.IntegerField(default=0)
+    token_total = MoneyField(default=Decimal(0))
+    # Only kept for the deposit currency rollups.
+    deposit_total = MoneyField(default=Decimal(0))
+
+    objects = SalesRollupManager()
+
+    class Meta:
+        unique_together = (('ico', 'kind', 'key'),)
+        index_together = (('ico', 'kind', 'bucket'),)
+
+
 class PurchaseMessage(DateModel):
     purchase = models.ForeignKey('ico.Purchase', related_name="messages")
     message = models.CharField(max_length=300)
@@ -338,17 +953,6 @@ class PurchaseManager(models.Manager):
         currency =  data.get('currency')
         metadata =  data.get('metadata')
 
-        # Check if the transaction is already associated to any purchases.
-        # This silently fails already initiated/executed transactions.
-        try:
-            self.get(Q(Q(deposit_tx=tx_id) | Q(token_tx=tx_id)),
-                quote__user__company=company)
-            logger.exception(
-                "Received already initiated transaction: {}".format(tx_id))
-            raise SilentException
-        except Purchase.DoesNotExist:
-            pass
-
         # Check if there is an open ICO and the ICO has at least one phase.
         # Exclude ICO instances that have the same currency code as the received
         # transaction.
@@ -374,17 +978,10 @@ class PurchaseManager(models.Manager):
             company=company)
 
         # Check for matching unused quotes, if none exist, create one.
-        try:
-            date_from = datetime.datetime.now() - datetime.timedelta(minutes=10)
-            quote = Quote.objects.filter(
-                user=user, 
-                deposit_amount=deposit_amount, 
-                deposit_currency=deposit_currency,
-                purchase=None,
-                phase=phase, 
-                created__gte=date_from).latest('created')
-
-        except Quote.DoesNotExist:
+        quote = Quote.objects.get_unused(user, phase, deposit_currency,
+            deposit_amount)
+
+        if quote is None:
             # Stop a new quote from being created if the deposit amount is
             # lower than the minimum allowed amount for the deposit currency
             # Silently fail the purchase so that Rehive does not keep retrying
@@ -433,13 +1030,15 @@ class PurchaseManager(models.Manager):
             raise SilentException
 
         # Try to find an existing purchase with the same deposit_tx as the 
-        # transaction received in the webhook.
+        # transaction received in the webhook. The token transaction may not
+        # have been created in Rehive yet, the status update is delivered
+        # after it.
         try:
-            purchase = self.exclude(token_tx__isnull=True).get(
+            purchase = self.get(
                 deposit_tx=tx_id,
                 status=PurchaseStatus.PENDING,
                 quote__user__company=company)
-        except Purchase.DoestNotExist:
+        except Purchase.DoesNotExist:
             logger.exception(
                 "Purchase does not exist for transaction: {}".format(tx_id))
             raise
@@ -448,11 +1047,12 @@ class PurchaseManager(models.Manager):
 
     @transaction.atomic()
     def create_purchase(self, quote, tx_id, status, metadata):
-        rehive = Rehive(quote.user.company.admin.token)
-
         # Create ICO purchase.
         purchase = self.create(quote=quote, deposit_tx=tx_id,
             status=status, metadata=metadata)
+        Quote.objects.filter(id=quote.id).update(purchased=True)
+        PurchaseTotal.objects.increment(quote.user_id, quote.phase.ico_id,
+            purchases=1)
 
         # Get token amount in cents for Rehive.
         token_divisibility = Decimal(
@@ -460,25 +1060,29 @@ class PurchaseManager(models.Manager):
         token_cent_amount = to_cents(
             quote.token_amount, token_divisibility)
 
-        # Create asscociated token credit transaction.
-        token_tx = rehive.admin.transactions.create_credit(
-            user=str(quote.user.identifier),
-            amount=token_cent_amount,
-            currency=quote.phase.ico.currency.code,
-            metadata=metadata,
-            confirm_on_create=False)
-
-        purchase.token_tx = token_tx['id']
-        purchase.save()
+        # Queue the asscociated token credit transaction, it is created in
+        # Rehive once this transaction is committed.
+        RehiveCommand.objects.create(
+            purchase=purchase,
+            command=CommandType.CREDIT,
+            data={
+                'user': str(quote.user.identifier),
+                'amount': token_cent_amount,
+                'currency': quote.phase.ico.currency.code,
+                'metadata': metadata,
+            })
 
-        return purchase  
+        return purchase
 
     def update_purchase(self, purchase, status):
         try:
-            rehive = Rehive(purchase.quote.user.company.admin.token) 
-
             with transaction.atomic():
-                purchase.lock_ico()
+                purchase.lock()
+
+                # The purchase was already completed or failed by another
+                # execute webhook.
+                if purchase.status != PurchaseStatus.PENDING:
+                    return purchase
 
                 if status == "Complete":
                     try:
@@ -487,7 +1091,12 @@ class PurchaseManager(models.Manager):
 
                         # Deduct amount.
                         purchase.quote.phase.ico.deduct_amount(
-                            purchase.quote.token_amount)
+                            purchase.quote.token_amount, key=purchase.id)
+                        PurchaseTotal.objects.increment(
+                            purchase.quote.user_id,
+                            purchase.quote.phase.ico_id,
+                            tokens=purchase.quote.token_amount)
+                        purchase.completed = datetime.datetime.now(tz=utc)
 
                     except PurchaseException as exc:
                         purchase.log_message(exc)
@@ -497,8 +1106,11 @@ class PurchaseManager(models.Manager):
                 purchase.status = status
                 purchase.save()
 
-                # Update associated Rehive token transaction.
-                rehive.admin.transactions.patch(purchase.token_tx, status)
+                # Queue the update of the associated Rehive token transaction.
+                RehiveCommand.objects.create(
+                    purchase=purchase,
+                    command=CommandType.PATCH,
+                    data={'status': status})
 
                 return purchase
 
@@ -513,8 +1125,7 @@ class PurchaseManager(models.Manager):
         user = purchase.quote.user
         token_amount = purchase.quote.token_amount
 
-        total_purchases = Quote.objects.exclude(purchase=None).filter(
-            user=user, phase__ico=ico).count()
+        total_purchases = PurchaseTotal.objects.get_count(user, ico)
 
         if total_purchases >= ico.max_purchases: 
             raise PurchaseException(
@@ -537,19 +1148,28 @@ class Purchase(DateModel):
     token_tx = models.CharField(unique=True, max_length=200, null=True)
     metadata = JSONField(null=True, blank=True, default=dict)
     status = EnumField(PurchaseStatus, max_length=50)
+    completed = models.DateTimeField(null=True, blank=True)
+    # Whether the completed purchase was added to the sales rollups, see
+    # `SalesRollupManager.fold`.
+    rolled_up = models.BooleanField(default=False)
 
     objects = PurchaseManager()
 
-    def lock_ico(self):
+    class Meta:
+        index_together = (('created', 'id'),)
+
+    def lock(self):
         """
-        Locks a transaction's ICO for concurrent balance changes.
+        Locks a purchase and its user for a status change and reloads the
+        status.
 
-        This should always be called first before any balance modifying methods
-        are invoked.
+        This should always be called first before the purchase is verified
+        and completed. ICO balance changes are atomic and do not need a lock.
         """
 
-        self.quote.phase.ico = Ico.objects.\
-            select_for_update().get(id=self.quote.phase.ico.id)
+        User.objects.select_for_update().get(id=self.quote.user_id)
+        self.status = Purchase.objects.select_for_update().get(
+            id=self.id).status
 
     def log_message(self, msg):
         """
@@ -571,4 +1191,320 @@ class Purchase(DateModel):
             message['message'] = "A server error occurred."
             message['exception'] = string_msg
 
-        PurchaseMessage.objects.create(**message)
\ No newline at end of file
+        PurchaseMessage.objects.create(**message)
+
+
+class RehiveCommandManager(models.Manager):
+
+    def pending(self):
+        """
+        Get the commands that are due for delivery, oldest first.
+        """
+
+        return self.filter(status=CommandStatus.PENDING,
+            next_attempt__lte=datetime.datetime.now(tz=utc)).order_by('id')
+
+    def dispatch(self, limit=100):
+        """
+        Deliver due commands to Rehive and return the number delivered.
+        """
+
+        delivered = 0
+        for command in self.pending()[:limit]:
+            # Commands of a purchase are delivered in order so that a token
+            # transaction is always created before it is updated.
+            if command.is_blocked():
+                continue
+
+            if command.claim() and command.deliver():
+                delivered += 1
+
+        return delivered
+
+
+class RehiveCommand(DateModel):
+    """
+    Outbound Rehive call committed in the same transaction as the purchase
+    change it belongs to, and delivered afterwards by the dispatcher.
+    """
+
+    purchase = models.ForeignKey('ico.Purchase', related_name='commands')
+    command = EnumField(CommandType, max_length=50)
+    data = JSONField(default=dict)
+    # Sent as the Rehive transaction reference so retried credits can be
+    # matched to a transaction created by an earlier attempt.
+    idempotency_key = models.UUIDField(default=uuid.uuid4, unique=True)
+    status = EnumField(CommandStatus, max_length=50,
+        default=CommandStatus.PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    error = models.TextField(null=True, blank=True)
+
+    objects = RehiveCommandManager()
+
+    class Meta:
+        index_together = (('status', 'next_attempt'),)
+
+    def is_blocked(self):
+        return RehiveCommand.objects.filter(purchase_id=self.purchase_id,
+            id__lt=self.id, status=CommandStatus.PENDING).exists()
+
+    def claim(self):
+        """
+        Claim the command for a single delivery attempt. The next attempt is
+        pushed past the request timeout so that no other dispatcher picks up
+        the command while it is being delivered.
+        """
+
+        lease = datetime.timedelta(seconds=settings.HTTP_READ_TIMEOUT * 2)
+        claimed = RehiveCommand.objects.filter(id=self.id,
+            status=CommandStatus.PENDING,
+            next_attempt=self.next_attempt).update(
+                attempts=F('attempts') + 1,
+                next_attempt=datetime.datetime.now(tz=utc) + lease)
+
+        if claimed:
+            self.attempts += 1
+
+        return bool(claimed)
+
+    def deliver(self):
+        """
+        Make the Rehive call. Failed calls are retried with an exponential
+        backoff until the maximum number of attempts is reached.
+        """
+
+        purchase = Purchase.objects.select_related(
+            'quote__user__company__admin').get(id=self.purchase_id)
+        rehive = get_rehive(purchase.quote.user.company.admin.token)
+
+        try:
+            if self.command == CommandType.CREDIT:
+                self._credit(rehive, purchase)
+            elif self.command == CommandType.PATCH:
+                if not purchase.token_tx:
+                    raise PurchaseException(
+                        "The token transaction was not created.")
+
+                rehive.admin.transactions.patch(purchase.token_tx,
+                    self.data['status'])
+        except Exception as exc:
+            logger.exception(exc)
+            self.error = str(exc)
+
+            if self.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                self.status = CommandStatus.FAILED
+                purchase.log_message(exc)
+            else:
+                self.next_attempt = datetime.datetime.now(tz=utc) + \
+                    datetime.timedelta(seconds=min(
+                        settings.OUTBOX_RETRY_BACKOFF * 2 ** self.attempts,
+                        settings.OUTBOX_MAX_RETRY_DELAY))
+
+            self.save()
+            return False
+
+        self.status = CommandStatus.COMPLETE
+        self.error = None
+        self.save()
+        return True
+
+    def _credit(self, rehive, purchase):
+        reference = str(self.idempotency_key)
+        transactions = rehive.admin.transactions
+
+        # A previous attempt may have created the transaction before failing.
+        existing = []
+        if self.attempts > 1:
+            existing = transactions.get(filters={'reference': reference})
+
+        if existing:
+            token_tx = existing[0]
+        else:
+            token_tx = transactions.create_credit(
+                reference=reference,
+                confirm_on_create=False,
+                **self.data)
+
+        Purchase.objects.filter(id=purchase.id).update(
+            token_tx=token_tx['id'], updated=datetime.datetime.now(tz=utc))
+
+
+class ProcessedEventManager(models.Manager):
+
+    def record(self, company, event, tx_id):
+        """
+        Record a webhook event as processed in the current transaction.
+        Returns False if it was already recorded. A concurrent duplicate waits
+        for the first transaction and is only recorded if that one rolled
+        back, so no unique constraint error is raised.
+        """
+
+        if tx_id is None:
+            return True
+
+        now = datetime.datetime.now(tz=utc)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {table} (created, updated, company_id, event, "
+                "tx_id) VALUES (%s, %s, %s, %s, %s) "
+                "ON CONFLICT (company_id, event, tx_id) DO NOTHING "
+                "RETURNING id".format(table=self.model._meta.db_table),
+                [now, now, company.id, event.value, str(tx_id)])
+            return cursor.fetchone() is not None
+
+
+class ProcessedEvent(DateModel):
+    """
+    Webhook event that was processed for a Rehive transaction.
+    """
+
+    company = models.ForeignKey('ico.Company')
+    event = EnumField(WebhookEvent, max_length=100)
+    tx_id = models.CharField(max_length=200)
+
+    objects = ProcessedEventManager()
+
+    class Meta:
+        unique_together = (('company', 'event', 'tx_id'),)
+
+
+class WebhookTaskManager(models.Manager):
+
+    @transaction.atomic()
+    def process_event(self, company, event, data):
+        """
+        Process a transaction webhook event once. Events that were already
+        processed are skipped, see `ProcessedEvent`.
+        """
+
+        if not ProcessedEvent.objects.record(company, event, data.get('id')):
+            logger.info("Received already processed {} event: {}".format(
+                event.value, data.get('id')))
+            return
+
+        try:
+            if event == WebhookEvent.TRANSACTION_INITIATE:
+                Purchase.objects.initiate_purchase(company, data)
+            elif event == WebhookEvent.TRANSACTION_EXECUTE:
+                Purchase.objects.execute_purchase(company, data)
+        except SilentException:
+            pass
+
+    def claim(self):
+        """
+        Lock the next due task, or return None if there is none. Must be
+        called in a transaction, the lock is held until it ends.
+
+        A task is only due once every earlier task of its company has been
+        processed. A company has a single ICO that webhooks apply to, so this
+        keeps the events of an ICO in order while other workers skip the
+        locked task and move on to other companies.
+        """
+
+        table = self.model._meta.db_table
+        pending = TaskStatus.PENDING.value
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT t.id FROM {table} t "
+                "WHERE t.status = %s AND t.next_attempt <= %s "
+                "AND NOT EXISTS ("
+                "SELECT 1 FROM {table} e WHERE e.company_id = t.company_id "
+                "AND e.status = %s AND e.id < t.id) "
+                "ORDER BY t.id LIMIT 1 "
+                "FOR UPDATE SKIP LOCKED".format(table=table),
+                [pending, datetime.datetime.now(tz=utc), pending])
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return self.select_related('company').get(id=row[0])
+
+    def process_next(self):
+        """
+        Process the next due task and return it, or None if there is none.
+        """
+
+        with transaction.atomic():
+            task = self.claim()
+            if task is not None:
+                task.process()
+
+        return task
+
+    def get_stats(self):
+        """
+        Get the queue depth, the age of the oldest pending task and the
+        average lag between receiving and processing recent tasks.
+        """
+
+        now = datetime.datetime.now(tz=utc)
+        pending = self.filter(status=TaskStatus.PENDING).aggregate(
+            depth=models.Count('id'), oldest=models.Min('created'))
+
+        recent = self.filter(processed__isnull=False,
+            processed__gte=now - datetime.timedelta(minutes=5))
+        lags = [(processed - created).total_seconds() for created, processed
+            in recent.values_list('created', 'processed')[:1000]]
+
+        return {
+            'depth': pending['depth'],
+            'oldest': (now - pending['oldest']).total_seconds()
+                if pending['oldest'] else 0,
+            'lag': sum(lags) / len(lags) if lags else 0,
+        }
+
+
+class WebhookTask(DateModel):
+    """
+    Received webhook event that is processed by a webhook worker.
+    """
+
+    company = models.ForeignKey('ico.Company')
+    event = EnumField(WebhookEvent, max_length=100)
+    data = JSONField(default=dict)
+    status = EnumField(TaskStatus, max_length=50, default=TaskStatus.PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    processed = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    objects = WebhookTaskManager()
+
+    class Meta:
+        index_together = (('status', 'next_attempt'), ('company', 'status'),)
+
+    def process(self):
+        """
+        Process the event. Failures are rolled back and retried with an
+        exponential backoff until the maximum number of attempts is reached.
+        """
+
+        self.attempts += 1
+
+        try:
+            with transaction.atomic():
+                WebhookTask.objects.process_event(
+                    self.company, self.event, self.data)
+        except Exception as exc:
+            logger.exception(exc)
+            self.error = str(exc)
+
+            if self.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                self.status = TaskStatus.FAILED
+            else:
+                self.next_attempt = datetime.datetime.now(tz=utc) + \
+                    datetime.timedelta(seconds=min(
+                        settings.WEBHOOK_RETRY_BACKOFF * 2 ** self.attempts,
+                        settings.WEBHOOK_MAX_RETRY_DELAY))
+        else:
+            self.status = TaskStatus.COMPLETE
+            self.error = None
+
+        if self.status != TaskStatus.PENDING:
+            self.processed = datetime.datetime.now(tz=utc)
+
+        self.save()
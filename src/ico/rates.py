@@ -1,6 +1,16 @@
-from requests import request
+import time
+import uuid
+from collections import deque
+from decimal import Decimal
+
 from django.core.cache import cache
 
+from ico.utils.sessions import get_session
+
+from logging import getLogger
+
+logger = getLogger('django')
+
 
 # Exchange used: https://apiv2.bitcoinaverage.com/
 # Exchange limit: 5000 requests per month
@@ -18,29 +28,227 @@ CONVERT = '{}/convert/global?from={source_cur}&to={target_cur}'
 
 # Cache keys
 # ================
-FIAT_RATES_CACHE_KEY = 'ico_service_fiat_rates'
-CRYPTO_RATES_CACHE_KEY = 'ico_service_crypto_rates'
+FIAT_RATES_CACHE_KEY = 'ico_service_fiat_rates_v2'
+CRYPTO_RATES_CACHE_KEY = 'ico_service_crypto_rates_v2'
+LOCK_CACHE_KEY = '{}_lock'
+VERSION_CACHE_KEY = '{}_version'
+
+# Cache timeouts (seconds)
+# ================
+# Rates older than the soft TTL are refreshed by a single process while the
+# others keep serving the stale rates. Rates are dropped after the hard TTL.
+SOFT_TTL = 600
+HARD_TTL = 3600
+# Maximum time a refreshing process may hold the lock.
+LOCK_TIMEOUT = 30
+# Interval at which processes without cached rates check for the refreshed
+# rates or try to take the lock.
+LOCK_POLL_INTERVAL = 0.1
+# Rates are kept in process memory for this long before the shared version
+# key is checked again.
+LOCAL_TTL = 30
+
+# In-process cache of (checked, expires, version, rates) per cache key.
+_local_rates = {}
+
+
+def _store_rates(cache_key, rates):
+    """
+    Store rates in the cache along with the time they become stale and a new
+    version. The version is also stored separately so that processes can
+    cheaply check whether their in-process rates are still current.
+    """
+    entry = (time.time() + SOFT_TTL, uuid.uuid4().hex, rates)
+    cache.set(cache_key, entry, HARD_TTL)
+    cache.set(VERSION_CACHE_KEY.format(cache_key), entry[1], HARD_TTL)
+    return entry
+
+
+def _get_shared_rates(cache_key, fetch):
+    """
+    Get rates from the cache with stale-while-revalidate semantics. Only the
+    process holding the cache lock calls the exchange, all other processes
+    serve stale rates or, if there are none, wait for the refresh to finish
+    and take the lock themselves if it failed.
+    """
+    entry = cache.get(cache_key)
+    if entry is not None and entry[0] > time.time():
+        return entry
+
+    lock_key = LOCK_CACHE_KEY.format(cache_key)
+
+    while True:
+        if cache.add(lock_key, True, LOCK_TIMEOUT):
+            try:
+                # The previous lock holder may have stored new rates since
+                # they were read.
+                current = cache.get(cache_key)
+                if current is not None and current[0] > time.time():
+                    return current
+                return fetch()
+            except Exception as exc:
+                if entry is None:
+                    raise
+                logger.exception(exc)
+                return entry
+            finally:
+                cache.delete(lock_key)
+
+        if entry is not None:
+            return entry
+
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return entry
+
+
+def _get_rates(cache_key, fetch):
+    """
+    Get rates from the in-process cache. Once LOCAL_TTL has passed only the
+    shared version key is checked, the rates themselves are only loaded from
+    the shared cache again if they were replaced or have become stale.
+    """
+    now = time.time()
+    local = _local_rates.get(cache_key)
+
+    if local is not None and now < local[1]:
+        if now < local[0] + LOCAL_TTL:
+            return local[3]
+
+        if cache.get(VERSION_CACHE_KEY.format(cache_key)) == local[2]:
+            _local_rates[cache_key] = (now,) + local[1:]
+            return local[3]
+
+    expires, version, rates = _get_shared_rates(cache_key, fetch)
+    _local_rates[cache_key] = (now, expires, version, rates)
+    return rates
+
+
+def _fetch_fiat_rates():
+    rates = get_session().get(FIAT_RATES).json().get('rates')
+    return _store_rates(FIAT_RATES_CACHE_KEY, rates)
+
+
+def _fetch_crypto_rates():
+    rates = get_session().get(CRYPTO_RATES).json()
+    return _store_rates(CRYPTO_RATES_CACHE_KEY, rates)
+
+
+def fetch_fiat_rates():
+    """
+    Make a request to the exchange to get updated fiat rates and store them
+    in the cache.
+    """
+    return _fetch_fiat_rates()[2]
+
+
+def fetch_crypto_rates():
+    """
+    Make a request to the exchange to get updated crypto rates and store them
+    in the cache.
+    """
+    return _fetch_crypto_rates()[2]
 
 
 def get_fiat_rates():
     """
-    Check the cache if the fiat rates have been stored, otherwise
+    Check the caches if the fiat rates have been stored, otherwise
     make a request to the exchange to get updated rates
     """
-    rates = cache.get(FIAT_RATES_CACHE_KEY)
-    if rates is None:
-        rates = request('GET', FIAT_RATES).json().get('rates')
-        cache.set(FIAT_RATES_CACHE_KEY, rates, 600)
-    return rates
+    return _get_rates(FIAT_RATES_CACHE_KEY, _fetch_fiat_rates)
 
 
 def get_crypto_rates():
     """
-    Check the cache if the crypto rates have been stored, otherwise
+    Check the caches if the crypto rates have been stored, otherwise
     make a request to the exchange to get updated rates
     """
-    rates = cache.get(CRYPTO_RATES_CACHE_KEY)
-    if rates is None:
-        rates = request('GET', CRYPTO_RATES).json()
-        cache.set(CRYPTO_RATES_CACHE_KEY, rates, 600)
-    return rates
+    return _get_rates(CRYPTO_RATES_CACHE_KEY, _fetch_crypto_rates)
+
+
+def exchange_code(code):
+    """
+    Convert a currency code to the code used by the exchange. The exchange
+    uses BTC instead of the proper XBT code for Bitcoin.
+    """
+    return 'BTC' if code == 'XBT' else code
+
+
+class RateMatrix(object):
+    """
+    Conversion rates between every pair of a set of currency codes, built
+    once from the fiat and crypto rates of the exchange.
+
+    Fiat rates are USD based so fiat pairs are converted through USD. All
+    other pairs are resolved through the shortest chain of exchange rates
+    (eg. EUR -> BTC -> ETH), which makes every lookup a single dictionary
+    access.
+    """
+
+    def __init__(self, fiat_rates, crypto_rates, codes):
+        codes = set(exchange_code(code) for code in codes)
+        self.fiat = {}
+        for code, value in fiat_rates.items():
+            rate = Decimal(str(value['rate']))
+            if rate:
+                self.fiat[code] = rate
+
+        graph = {}
+        self._build_graph(graph, crypto_rates, codes | set(self.fiat))
+
+        self.rates = {}
+        for source in codes:
+            resolved = self._resolve(graph, source)
+            for target in codes:
+                if source in self.fiat and target in self.fiat:
+                    self.rates[(source, target)] = \
+                        self.fiat[target] / self.fiat[source]
+                elif target in resolved:
+                    self.rates[(source, target)] = resolved[target]
+
+    def _build_graph(self, graph, crypto_rates, known_codes):
+        def add(source, target, rate):
+            graph.setdefault(source, {})[target] = rate
+            graph.setdefault(target, {})[source] = 1 / rate
+
+        for code, rate in self.fiat.items():
+            if code != 'USD':
+                add('USD', code, rate)
+
+        # Crypto rates are listed as currency pairs (symbols) without a
+        # separator. Eg. ETHBTC means one ETH is worth `last` BTC.
+        for symbol, value in crypto_rates.items():
+            last = value.get('last')
+            if not last:
+                continue
+
+            for i in range(1, len(symbol)):
+                if symbol[:i] in known_codes and symbol[i:] in known_codes:
+                    add(symbol[:i], symbol[i:], Decimal(str(last)))
+                    break
+
+    @staticmethod
+    def _resolve(graph, source):
+        """
+        Breadth first search for the shortest conversion path from the source
+        to every reachable currency.
+        """
+        resolved = {source: Decimal(1)}
+        queue = deque([source])
+
+        while queue:
+            code = queue.popleft()
+            for target, rate in graph.get(code, {}).items():
+                if target not in resolved:
+                    resolved[target] = resolved[code] * rate
+                    queue.append(target)
+
+        return resolved
+
+    def get(self, source, target):
+        """
+        Get the amount of the target currency that one unit of the source
+        currency is worth, or None if there is no conversion between them.
+        """
+        return self.rates.get((exchange_code(source), exchange_code(target)))
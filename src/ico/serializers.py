@@ -6,17 +6,19 @@ from decimal import Decimal
 
 from rest_framework import serializers, exceptions
 from rest_framework.serializers import ModelSerializer
+from django.conf import settings
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
 
 from ico.models import *
 from ico.exceptions import SilentException
 from ico.enums import WebhookEvent, PurchaseStatus, IcoStatus
-from ico.authentication import HeaderAuthentication
-from rehive import Rehive, APIException
+from ico.authentication import HeaderAuthentication, invalidate_token
+from rehive import APIException
 from ico.utils.common import (
     to_cents, from_cents
 )
+from ico.utils.sessions import get_rehive
 
 from logging import getLogger
 
@@ -52,7 +54,7 @@ class ActivateSerializer(serializers.Serializer):
     secret = serializers.UUIDField(read_only=True)
 
     def validate(self, validated_data):
-        rehive = Rehive(validated_data.get('token'))
+        rehive = get_rehive(validated_data.get('token'))
 
         try:
             user = rehive.user.get()
@@ -117,7 +119,7 @@ class DeactivateSerializer(serializers.Serializer):
     token = serializers.CharField(write_only=True)
 
     def validate(self, validated_data):
-        rehive = Rehive(validated_data.get('token'))
+        rehive = get_rehive(validated_data.get('token'))
 
         try:
             user = rehive.user.get()
@@ -140,6 +142,7 @@ class DeactivateSerializer(serializers.Serializer):
         # Deleting the owner will cascade delete the company and all other
         # children objects.
         self.validated_data['company'].admin.delete()
+        invalidate_token(self.validated_data['token'])
 
         # TODO: Also delete Rehive webhooks using SDK.
         # Need to update Rehive to allow filtering of webhooks by secret.
@@ -165,9 +168,20 @@ class AdminWebhookSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         data = validated_data.get('data')
-        event = validated_data['event']['value']
+        event = WebhookEvent(validated_data['event']['value'])
         company = validated_data.get('company')
 
+        # Queue the event for the webhook workers.
+        if settings.WEBHOOK_QUEUE_ENABLED:
+            WebhookTask.objects.create(company=company, event=event,
+                data=data)
+            return validated_data
+
+        try:
+            WebhookTask.objects.process_event(company, event, data)
+        except ObjectDoesNotExist as exc:
+            raise serializers.ValidationError({"non_field_errors": str(exc)})
+
         return validated_data
 
 
@@ -190,19 +204,6 @@ class AdminTransactionInitiateWebhookSerializer(AdminWebhookSerializer):
 
         return data
 
-    def create(self, validated_data):
-        company = validated_data.get('company')
-        data = validated_data.get('data')
-
-        try:
-            Purchase.objects.initiate_purchase(company, data)            
-        except SilentException:
-            return validated_data
-        except ObjectDoesNotExist as exc:
-            raise serializers.ValidationError({"non_field_errors": str(exc)})
-
-        return validated_data
-
 
 class AdminTransactionExecuteWebhookSerializer(AdminWebhookSerializer):
     """
@@ -226,19 +227,6 @@ class AdminTransactionExecuteWebhookSerializer(AdminWebhookSerializer):
 
         return data
 
-    def create(self, validated_data):
-        company = validated_data.get('company')
-        data = validated_data.get('data')
-
-        try:
-            Purchase.objects.execute_purchase(company, data)            
-        except SilentException:
-            return validated_data
-        except ObjectDoesNotExist as exc:
-            raise serializers.ValidationError({"non_field_errors": str(exc)})
-
-        return validated_data
-
 
 class CurrencySerializer(serializers.ModelSerializer):
     """
@@ -361,10 +349,7 @@ class AdminCreateIcoSerializer(IcoSerializer):
 
     def create(self, validated_data):
         validated_data['company'] = self.context['request'].user.company
-
-        if validated_data.get('status'):
-            validated_data['status'] = IcoStatus(
-                validated_data['status']['value'])
+        status = validated_data.pop('status', None)
 
         try:
             validated_data['amount'] = from_cents(
@@ -415,7 +400,13 @@ class AdminCreateIcoSerializer(IcoSerializer):
         #       tx_type: credit
         #       secret: company.secret
 
-        return Ico.objects.create(**validated_data)
+        with transaction.atomic():
+            ico = Ico.objects.create(**validated_data)
+
+            if status:
+                ico.set_status(IcoStatus(status['value']))
+
+        return ico
 
 
 class AdminIcoSerializer(serializers.ModelSerializer, DatesMixin):
@@ -479,10 +470,8 @@ class AdminUpdateIcoSerializer(AdminIcoSerializer):
     max_purchase_amount = serializers.IntegerField()
 
     def update(self, instance, validated_data):
-        if validated_data.get('status'):
-            validated_data['status'] = IcoStatus(
-                validated_data['status']['value'])
-        
+        status = validated_data.pop('status', None)
+
         if validated_data.get('min_purchase_amount'):
             try:
                 validated_data['min_purchase_amount'] = from_cents(
@@ -506,7 +495,12 @@ class AdminUpdateIcoSerializer(AdminIcoSerializer):
         for key, value in validated_data.items():
             setattr(instance, key, value)
 
-        instance.save()
+        with transaction.atomic():
+            instance.save()
+
+            if status:
+                instance.set_status(IcoStatus(status['value']))
+
         return instance
 
 
@@ -583,14 +577,18 @@ class AdminCreatePhaseSerializer(serializers.ModelSerializer):
 class AdminRateSerializer(serializers.ModelSerializer, DatesMixin):
     currency = CurrencySerializer(read_only=True)
     rate = serializers.SerializerMethodField()
+    as_of = serializers.SerializerMethodField()
 
     class Meta:
         model = Rate
-        fields = ('id', 'currency', 'rate', 'created', 'updated')
+        fields = ('id', 'currency', 'rate', 'as_of', 'created', 'updated')
 
     def get_rate(self, obj):
         return to_cents(obj.rate, obj.currency.divisibility)
 
+    def get_as_of(self, obj):
+        return int(obj.as_of.timestamp() * 1000)
+
 
 class AdminQuoteSerializer(serializers.ModelSerializer, DatesMixin):
     user = serializers.CharField()
@@ -653,54 +651,34 @@ class UserIcoSerializer(IcoSerializer):
 class UserRateSerializer(serializers.ModelSerializer, DatesMixin):
     currency = CurrencySerializer(read_only=True)
     rate = serializers.SerializerMethodField()
+    as_of = serializers.SerializerMethodField()
 
     class Meta:
         model = Rate
-        fields = ('id', 'currency', 'rate', 'created', 'updated')
+        fields = ('id', 'currency', 'rate', 'as_of', 'created', 'updated')
 
     def get_rate(self, obj):
         return to_cents(obj.rate, obj.currency.divisibility)
 
+    def get_as_of(self, obj):
+        return int(obj.as_of.timestamp() * 1000)
 
-class UserCreateQuoteSerializer(serializers.ModelSerializer):
-    deposit_amount = serializers.IntegerField(required=False)
-    deposit_currency = serializers.CharField()
-    token_amount = serializers.IntegerField(required=False)
-
-    class Meta:
-        model = Quote
-        fields = ('deposit_amount', 'deposit_currency', 'token_amount',)
-
-    def validate_deposit_currency(self, currency):
-        company = self.context['request'].user.company
-
-        try:
-            return Currency.objects.get(code__iexact=currency, company=company, 
-                enabled=True)  
-        except Currency.DoesNotExist:
-            raise serializers.ValidationError("Invalid currency.")
-
-    def validate(self, validated_data):
-        user = self.context['request'].user
-        ico_id = self.context.get('view').kwargs.get('ico_id')
-
-        # Check that only one amount exists.
-        deposit_amount = validated_data.get('deposit_amount')
-        token_amount = validated_data.get('token_amount')
 
-        if not deposit_amount and not token_amount:
-            raise serializers.ValidationError(
-                {"non_field_errors": 
-                    ["A deposit amount or token amount must be inserted."]})            
+class QuoteMixin(object):
+    """
+    Shared ICO validation and pricing for quote serializers.
+    """
 
-        if deposit_amount and token_amount:
-            raise serializers.ValidationError(
-                {"non_field_errors": 
-                    ["only deposit amount or token amount must be inserted."]})
+    def get_quote_phase(self, user, ico_id):
+        """
+        Get the active phase of a live ICO, and check that the user can still
+        make purchases for it.
+        """
 
         # Find a live ICO.
         try:
-            ico = Ico.objects.get(company=user.company, id=ico_id)
+            ico = Ico.objects.select_related('currency').get(
+                company=user.company, id=ico_id)
 
             if ico.status != IcoStatus.OPEN:
                 raise serializers.ValidationError(
@@ -716,29 +694,21 @@ class UserCreateQuoteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {"non_field_errors": ["The ICO has no active phases."]})
 
-        validated_data['phase'] = phase
-
         # Stop quotes if max_purchases is exceeded.
-        total_purchases = user.quote_set.exclude(purchase=None).filter(
-            phase__ico=ico).count()
+        total_purchases = PurchaseTotal.objects.get_count(user, ico)
 
         if total_purchases >= ico.max_purchases: 
             raise serializers.ValidationError(
                 {"non_field_errors": 
                     ["You have reached the max purchases allowed."]})   
 
-        return validated_data       
-
-    def create(self, validated_data):
-        user = self.context['request'].user
-
-        deposit_amount = validated_data.get('deposit_amount')
-        token_amount = validated_data.get('token_amount')
-        deposit_currency = validated_data.get('deposit_currency')
-        phase = validated_data.get('phase')
+        return phase
 
-        # Deposit rate
-        rate = Rate.objects.get(phase=phase, currency=deposit_currency)
+    def price_quote(self, phase, rate, deposit_currency, deposit_amount=None,
+            token_amount=None):
+        """
+        Calculate the quote amounts for a deposit or token amount in cents.
+        """
 
         # If a deposit amount is submitted than a ICO token amount needs to be 
         # calculated.
@@ -776,8 +746,7 @@ class UserCreateQuoteSerializer(serializers.ModelSerializer):
                         currency=deposit_currency
                     )]})
 
-        create_data = {
-            "user": user,
+        return {
             "phase": phase,
             "deposit_amount": deposit_amount,
             "deposit_currency": deposit_currency,
@@ -785,9 +754,184 @@ class UserCreateQuoteSerializer(serializers.ModelSerializer):
             "rate": rate.rate,
         }
 
+
+class UserCreateQuoteSerializer(QuoteMixin, serializers.ModelSerializer):
+    deposit_amount = serializers.IntegerField(required=False)
+    deposit_currency = serializers.CharField()
+    token_amount = serializers.IntegerField(required=False)
+
+    class Meta:
+        model = Quote
+        fields = ('deposit_amount', 'deposit_currency', 'token_amount',)
+
+    def validate_deposit_currency(self, currency):
+        company = self.context['request'].user.company
+
+        try:
+            return Currency.objects.get(code__iexact=currency, company=company, 
+                enabled=True)  
+        except Currency.DoesNotExist:
+            raise serializers.ValidationError("Invalid currency.")
+
+    def validate(self, validated_data):
+        user = self.context['request'].user
+        ico_id = self.context.get('view').kwargs.get('ico_id')
+
+        # Check that only one amount exists.
+        deposit_amount = validated_data.get('deposit_amount')
+        token_amount = validated_data.get('token_amount')
+
+        if not deposit_amount and not token_amount:
+            raise serializers.ValidationError(
+                {"non_field_errors": 
+                    ["A deposit amount or token amount must be inserted."]})            
+
+        if deposit_amount and token_amount:
+            raise serializers.ValidationError(
+                {"non_field_errors": 
+                    ["only deposit amount or token amount must be inserted."]})
+
+        validated_data['phase'] = self.get_quote_phase(user, ico_id)
+
+        return validated_data       
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+
+        deposit_currency = validated_data.get('deposit_currency')
+        phase = validated_data.get('phase')
+
+        # Deposit rate
+        rate = Rate.objects.get(phase=phase, currency=deposit_currency)
+
+        create_data = self.price_quote(phase, rate, deposit_currency,
+            validated_data.get('deposit_amount'),
+            validated_data.get('token_amount'))
+        create_data['user'] = user
+
         return super(UserCreateQuoteSerializer, self).create(create_data)
 
 
+class UserBulkQuoteItemSerializer(serializers.Serializer):
+    deposit_amount = serializers.IntegerField(required=False)
+    deposit_currency = serializers.CharField()
+    token_amount = serializers.IntegerField(required=False)
+
+    def validate(self, validated_data):
+        # Check that only one amount exists.
+        deposit_amount = validated_data.get('deposit_amount')
+        token_amount = validated_data.get('token_amount')
+
+        if not deposit_amount and not token_amount:
+            raise serializers.ValidationError(
+                {"non_field_errors": 
+                    ["A deposit amount or token amount must be inserted."]})            
+
+        if deposit_amount and token_amount:
+            raise serializers.ValidationError(
+                {"non_field_errors": 
+                    ["only deposit amount or token amount must be inserted."]})
+
+        return validated_data
+
+
+class UserCreateBulkQuoteSerializer(QuoteMixin, serializers.Serializer):
+    """
+    Price a list of deposit currency and amount pairs in one request. The ICO,
+    phase, purchase limit and rates are resolved once for all quotes.
+    """
+
+    quotes = UserBulkQuoteItemSerializer(many=True)
+
+    def validate_quotes(self, quotes):
+        if not quotes:
+            raise serializers.ValidationError("At least one quote is required.")
+
+        if len(quotes) > settings.MAX_BULK_QUOTES:
+            raise serializers.ValidationError(
+                "At most {} quotes can be requested.".format(
+                    settings.MAX_BULK_QUOTES))
+
+        return quotes
+
+    def validate(self, validated_data):
+        user = self.context['request'].user
+        ico_id = self.context.get('view').kwargs.get('ico_id')
+
+        phase = self.get_quote_phase(user, ico_id)
+
+        currencies = {currency.code.upper(): currency
+            for currency in Currency.objects.filter(company=user.company,
+                enabled=True)}
+        rates = {rate.currency_id: rate
+            for rate in Rate.objects.filter(phase_id=phase.id,
+                currency__in=currencies.values())}
+
+        quotes = []
+        errors = []
+        for item in validated_data['quotes']:
+            try:
+                currency = currencies.get(item['deposit_currency'].upper())
+                if currency is None:
+                    raise serializers.ValidationError(
+                        {"deposit_currency": ["Invalid currency."]})
+
+                if currency.id not in rates:
+                    raise serializers.ValidationError(
+                        {"deposit_currency": ["No rate for the currency."]})
+
+                quotes.append(self.price_quote(phase, rates[currency.id],
+                    currency, item.get('deposit_amount'),
+                    item.get('token_amount')))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+
+        if any(errors):
+            raise serializers.ValidationError({"quotes": errors})
+
+        validated_data['quotes'] = quotes
+        return validated_data
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+
+        return Quote.objects.create_bulk([Quote(user=user, **data)
+            for data in validated_data['quotes']])
+
+
+class AdminSalesRollupSerializer(serializers.ModelSerializer):
+    token_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SalesRollup
+        fields = ('purchase_count', 'token_total',)
+
+    def get_token_total(self, obj):
+        return to_cents(obj.token_total, obj.ico.currency.divisibility)
+
+
+class AdminPhaseSalesSerializer(AdminSalesRollupSerializer):
+    level = serializers.IntegerField(source='phase.level')
+
+    class Meta:
+        model = SalesRollup
+        fields = ('phase', 'level', 'purchase_count', 'token_total',)
+
+
+class AdminCurrencySalesSerializer(AdminSalesRollupSerializer):
+    currency = CurrencySerializer(read_only=True)
+    deposit_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SalesRollup
+        fields = ('currency', 'purchase_count', 'token_total',
+            'deposit_total',)
+
+    def get_deposit_total(self, obj):
+        return to_cents(obj.deposit_total, obj.currency.divisibility)
+
+
 class UserQuoteSerializer(serializers.ModelSerializer, DatesMixin):
     deposit_currency = CurrencySerializer(read_only=True)
     deposit_amount = serializers.SerializerMethodField()
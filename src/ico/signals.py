@@ -1,7 +1,16 @@
 from django.db.models.signals import post_save, post_init
 from django.dispatch import receiver
 
-from ico.models import Phase, Rate
+from ico.models import Currency, Ico, Phase, Rate, RateSnapshot
+
+
+@receiver(post_save, sender=Phase)
+def invalidate_ico(sender, instance, **kwargs):
+    """
+    Rebuild the phase table and invalidate the cached public responses of the
+    ICO when a phase changes.
+    """
+    Ico.all_objects.get(id=instance.ico_id).update_phase_thresholds()
 
 
 @receiver(post_save, sender=Phase)
@@ -13,6 +22,12 @@ def create_rate(sender, instance, created, **kwargs):
     if not created:
         return
 
-    for currency in instance.ico.company.currency_set.all():
-        rate, _ = Rate.objects.get_or_create(phase=instance, currency=currency)
-        rate.refresh_rate()
+    snapshot = RateSnapshot.objects.current()
+    currencies = list(Currency.objects.filter(
+        company_id=instance.ico.company_id))
+    matrix = snapshot.get_matrix(set(currency.code for currency in currencies))
+
+    for currency in currencies:
+        # Currencies without an exchange rate get no Rate, the rate refresher
+        # creates it once a rate is available.
+        Rate(phase=instance, currency=currency).refresh_rate(snapshot, matrix)
@@ -1,3 +1,1137 @@
-from django.test import TestCase
+import datetime
+import importlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import utc
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from rehive import APIException
+
+from ico import rates
+from ico.authentication import AdminAuthentication, get_token_cache_key
+from ico.utils import cache as response_cache
+from ico.utils import events
+from ico.views import ResultsSetCursorPagination
+from ico.enums import (
+    CommandStatus, CommandType, IcoStatus, PurchaseStatus, RollupKind,
+    TaskStatus, WebhookEvent
+)
+from ico.models import (
+    Company, Currency, Ico, IcoShard, Phase, ProcessedEvent, Purchase, Quote,
+    Rate, RateSnapshot, RehiveCommand, SalesRollup, User, WebhookTask
+)
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ico-tests',
+    }
+}
+
+
+def create_company(currencies=1, identifier='test_company'):
+    """
+    Create a company with an admin user and a number of currencies. An
+    exchange rate snapshot is created as well so that no exchange requests
+    are made when phases create their rates.
+    """
+
+    codes = ['C{}'.format(i) for i in range(currencies - 2)]
+    RateSnapshot.objects.create(
+        fiat_rates={code: {'rate': 2} for code in ['USD'] + codes},
+        crypto_rates={'BTCUSD': {'last': 4000}})
+
+    admin = User.objects.create(identifier=uuid.uuid4(), token='token')
+    company = Company.objects.create(identifier=identifier, admin=admin,
+        secret=uuid.uuid4())
+    admin.company = company
+    admin.save()
+
+    Currency.objects.create(company=company, code='USD', divisibility=2)
+    Currency.objects.create(company=company, code='XBT', divisibility=8)
+    for code in codes:
+        Currency.objects.create(company=company, code=code)
+
+    return company
+
+
+def create_ico(company, phases=1, amount=Decimal(1000),
+        status=IcoStatus.OPEN, **kwargs):
+    """
+    Create a public ICO of the company with phases of equal size.
+    """
+
+    ico = Ico.objects.create(company=company, amount=amount,
+        currency=Currency.objects.get(company=company, code='XBT'),
+        base_currency=Currency.objects.get(company=company, code='USD'),
+        status=status, public=True, **kwargs)
+
+    for level in range(1, phases + 1):
+        Phase.objects.create(ico=ico, level=level,
+            percentage=100 // phases, base_rate=Decimal(level))
+
+    return Ico.objects.get(id=ico.id)
+
+
+class StandInExchange(object):
+    """
+    Local stand-in for the exchange that counts the requests made to it.
+    Requests take `delay` seconds, the first `failures` requests fail.
+    """
+
+    def __init__(self, delay=0.2, failures=0):
+        self.delay = delay
+        self.failures = failures
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.calls += 1
+            fail = self.calls <= self.failures
+
+        time.sleep(self.delay)
+        if fail:
+            raise IOError("Exchange unavailable.")
+
+        response = mock.Mock()
+        response.json.return_value = {'rates': {'EUR': {'rate': 0.85}}}
+        return response
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RatesCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        rates.cache.clear()
+        rates._local_rates.clear()
+
+    def get_concurrently(self, exchange, count=50):
+        results = []
+        errors = []
+
+        def get():
+            try:
+                results.append(rates.get_fiat_rates())
+            except Exception as exc:
+                errors.append(exc)
+
+        with mock.patch('ico.rates.get_session', return_value=exchange), \
+                mock.patch('ico.rates.LOCK_POLL_INTERVAL', 0.01):
+            threads = [threading.Thread(target=get) for i in range(count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return results, errors
+
+    def test_concurrent_misses_fetch_once(self):
+        exchange = StandInExchange()
+        results, errors = self.get_concurrently(exchange)
+
+        self.assertEqual(exchange.calls, 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 50)
+        self.assertTrue(all(r == {'EUR': {'rate': 0.85}} for r in results))
+
+    def test_failed_fetch_is_retried_by_one_waiter(self):
+        exchange = StandInExchange(failures=1)
+        results, errors = self.get_concurrently(exchange)
+
+        self.assertEqual(exchange.calls, 2)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(results), 49)
+
+    def test_stale_rates_are_served_during_refresh(self):
+        rates.cache.set(rates.FIAT_RATES_CACHE_KEY,
+            (time.time() - 1, 'stale', {'EUR': {'rate': 0.8}}), rates.HARD_TTL)
+        rates.cache.add(rates.LOCK_CACHE_KEY.format(
+            rates.FIAT_RATES_CACHE_KEY), True, rates.LOCK_TIMEOUT)
+
+        exchange = StandInExchange()
+        results, errors = self.get_concurrently(exchange)
+
+        self.assertEqual(exchange.calls, 0)
+        self.assertTrue(all(r == {'EUR': {'rate': 0.8}} for r in results))
+
+
+class IcoChangeListenerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.channel = events.IcoChannel(1)
+        events._channels[1] = self.channel
+        self.addCleanup(events._channels.clear)
+
+    def test_notifications_received_while_refreshing_are_drained(self):
+        conn = mock.Mock(notifies=[mock.Mock(payload='1,2')])
+        loads = []
+
+        def load(ico_ids):
+            loads.append(ico_ids)
+            if len(loads) == 1:
+                # Received while the refresh query ran.
+                conn.notifies.append(mock.Mock(payload='1'))
+            return {1: 'state {}'.format(len(loads))}
+
+        events.IcoChangeListener(load).drain(conn)
+
+        self.assertEqual(loads, [[1], [1]])
+        self.assertEqual(conn.notifies, [])
+        self.assertEqual((self.channel.version, self.channel.payload),
+            (2, 'state 2'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.company = create_company()
+        self.rehive = mock.Mock()
+        self.rehive.user.get.return_value = {
+            'identifier': str(self.company.admin.identifier),
+            'company': self.company.identifier,
+            'permission_groups': [{'name': 'admin'}],
+        }
+
+        patcher = mock.patch('ico.authentication.get_rehive',
+            return_value=self.rehive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_token_skips_rehive(self):
+        auth = AdminAuthentication()
+        user = auth.introspect('token')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(auth.introspect('token'), user)
+
+        self.assertEqual(user, self.company.admin)
+        self.assertEqual(self.rehive.user.get.call_count, 1)
+
+    def test_invalid_token_is_cached_until_expiry(self):
+        self.rehive.user.get.side_effect = APIException('Invalid', 401)
+        auth = AdminAuthentication()
+
+        for i in range(2):
+            with self.assertRaises(AuthenticationFailed):
+                auth.introspect('token')
+        self.assertEqual(self.rehive.user.get.call_count, 1)
+
+        expired = time.time() + settings.AUTH_NEGATIVE_CACHE_TTL + 1
+        with mock.patch('time.time', return_value=expired), \
+                self.assertRaises(AuthenticationFailed):
+            auth.introspect('token')
+        self.assertEqual(self.rehive.user.get.call_count, 2)
+
+    def test_deactivation_evicts_token(self):
+        AdminAuthentication().introspect('token')
+        self.assertIsNotNone(cache.get(get_token_cache_key('token')))
+
+        with mock.patch('ico.serializers.get_rehive',
+                return_value=self.rehive):
+            response = APIClient().post('/api/deactivate/',
+                {'token': 'token'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(get_token_cache_key('token')))
+        self.assertFalse(Company.objects.filter(id=self.company.id).exists())
+
+
+class RateMatrixTests(SimpleTestCase):
+
+    def setUp(self):
+        self.matrix = rates.RateMatrix(
+            {'USD': {'rate': 1}, 'EUR': {'rate': 0.8}, 'ZAR': {'rate': 14}},
+            {'BTCUSD': {'last': 4000}, 'ETHBTC': {'last': 0.05}},
+            ('USD', 'EUR', 'ZAR', 'XBT', 'ETH', 'LTC',))
+
+    def test_direct_pair(self):
+        self.assertEqual(self.matrix.get('XBT', 'USD'), Decimal(4000))
+        self.assertEqual(self.matrix.get('EUR', 'ZAR'), Decimal('17.5'))
+
+    def test_inverse_pair(self):
+        self.assertEqual(self.matrix.get('USD', 'XBT'), Decimal('0.00025'))
+        self.assertEqual(self.matrix.get('XBT', 'ETH'), Decimal(20))
+
+    def test_multiple_hops(self):
+        self.assertEqual(self.matrix.get('ETH', 'USD'), Decimal(200))
+        self.assertEqual(self.matrix.get('ETH', 'EUR'), Decimal(160))
+        self.assertEqual(self.matrix.get('EUR', 'ETH'), 1 / Decimal(160))
+
+    def test_missing_pair(self):
+        self.assertIsNone(self.matrix.get('LTC', 'USD'))
+        self.assertIsNone(self.matrix.get('ETH', 'LTC'))
+        # Not one of the codes the matrix was built for.
+        self.assertIsNone(self.matrix.get('USD', 'GBP'))
+
+
+class RateQueryTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=100)
+        self.ico = create_ico(self.company)
+        self.phase = Phase.objects.get(ico=self.ico)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.company.admin)
+
+    def test_rates_load_without_queries(self):
+        with self.assertNumQueries(1):
+            rates = list(Rate.objects.filter(phase=self.phase))
+
+        self.assertEqual(len(rates), 100)
+
+    def test_admin_rate_list_queries(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(
+                '/api/admin/icos/{}/phases/{}/rates/?page_size=100'.format(
+                    self.ico.id, self.phase.id))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']['results']), 100)
+
+    def test_user_rate_list_queries(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(
+                '/api/user/icos/{}/rates/?page_size=100'.format(self.ico.id))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']['results']), 100)
+
+
+class RateRefreshTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company()
+        # No exchange rate is known for this currency.
+        self.currency = Currency.objects.create(company=self.company,
+            code='ZZZ')
+
+    def test_phase_without_currency_pair_is_saved(self):
+        ico = create_ico(self.company)
+        phase = Phase.objects.get(ico=ico)
+
+        self.assertEqual(
+            set(Rate.objects.filter(phase=phase).values_list(
+                'currency__code', flat=True)),
+            {'USD', 'XBT'})
+
+    def test_missing_currency_pair_keeps_stored_rate(self):
+        ico = create_ico(self.company)
+        phase = Phase.objects.get(ico=ico)
+        rate = Rate.objects.create(phase=phase, currency=self.currency,
+            rate=Decimal(3))
+
+        self.assertFalse(rate.refresh_rate())
+        self.assertEqual(Rate.objects.get(id=rate.id).rate, Decimal(3))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IcoListQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = create_company(currencies=2)
+        for i in range(250):
+            create_ico(cls.company, phases=3, status=IcoStatus.CLOSED)
+
+    def setUp(self):
+        rates.cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.company.admin)
+
+    def assertPageQueries(self, url, num):
+        for page_size in (10, 50, 250):
+            with self.subTest(page_size=page_size):
+                rates.cache.clear()
+                with self.assertNumQueries(num):
+                    response = self.client.get(url, {'page_size': page_size})
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['data']['results']),
+                    page_size)
+
+    def test_ico_list_queries(self):
+        self.assertPageQueries('/api/icos/', 2)
+
+    def test_admin_ico_list_queries(self):
+        self.assertPageQueries('/api/admin/icos/', 3)
+
+    def test_user_ico_list_queries(self):
+        self.assertPageQueries('/api/user/icos/', 3)
+
+
+class IcoResponseCacheTests(TestCase):
+
+    def setUp(self):
+        response_cache._local_versions.clear()
+        response_cache._local_responses.clear()
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company)
+        self.url = '/api/icos/{}/'.format(self.ico.id)
+
+    def test_cache_hits_do_not_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+
+        self.assertEqual(cached.content, response.content)
+
+    def test_not_modified_does_not_query(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_bumped_version_is_not_served_stale(self):
+        etag = self.client.get(self.url)['ETag']
+
+        # What bump_ico_versions runs once the transaction is committed.
+        response_cache._bump_versions({self.ico.id})
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class IcoVersionBumpTests(TransactionTestCase):
+
+    def setUp(self):
+        patcher = mock.patch('ico.utils.cache.notify_ico_changes')
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bumps_are_notified_once_after_commit(self):
+        with transaction.atomic():
+            response_cache.bump_ico_versions(1)
+            with transaction.atomic():
+                response_cache.bump_ico_versions(2, 1)
+            response_cache.bump_ico_versions(3)
+
+            self.assertFalse(self.notify.called)
+
+        self.assertEqual(self.notify.call_count, 1)
+        self.assertEqual(set(self.notify.call_args[0]), {1, 2, 3})
+
+    def test_rolled_back_bumps_are_not_notified(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            response_cache.bump_ico_versions(1)
+            raise ValueError
+
+        self.assertFalse(self.notify.called)
+
+        # A later transaction of the thread is notified on its own.
+        with transaction.atomic():
+            response_cache.bump_ico_versions(2)
+
+        self.notify.assert_called_once_with(2)
+
+    def test_bump_outside_a_transaction_is_notified_immediately(self):
+        response_cache.bump_ico_versions(1)
+        response_cache.bump_ico_versions(2)
+
+        self.assertEqual([call[0] for call in self.notify.call_args_list],
+            [(1,), (2,)])
+
+
+class BulkQuoteTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company)
+        self.url = '/api/user/icos/{}/quotes/'.format(self.ico.id)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.company.admin)
+
+    def post(self, quotes):
+        return self.client.post(self.url, {'quotes': quotes}, format='json')
+
+    def test_quotes_are_created_in_one_batch(self):
+        response = self.post([
+            {'deposit_currency': 'USD', 'deposit_amount': 1000},
+            {'deposit_currency': 'XBT', 'deposit_amount': 100000},
+            {'deposit_currency': 'usd', 'token_amount': 100000000},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['data']), 3)
+        self.assertEqual(Quote.objects.filter(user=self.company.admin,
+            phase__ico=self.ico).count(), 3)
+
+    def test_batch_over_the_limit_is_rejected(self):
+        with self.settings(MAX_BULK_QUOTES=2):
+            response = self.post(
+                [{'deposit_currency': 'USD', 'deposit_amount': 1000}] * 3)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['data']['quotes'],
+            ['At most 2 quotes can be requested.'])
+        self.assertFalse(Quote.objects.exists())
+
+    def test_invalid_item_rejects_the_batch(self):
+        response = self.post([
+            {'deposit_currency': 'USD', 'deposit_amount': 1000},
+            {'deposit_currency': 'EUR', 'deposit_amount': 1000},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['data']['quotes'],
+            [{}, {'deposit_currency': ['Invalid currency.']}])
+        self.assertFalse(Quote.objects.exists())
+
+
+class CursorPaginationTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company)
+        phase = Phase.objects.get(ico=self.ico)
+        currency = Currency.objects.get(company=self.company, code='USD')
+
+        # Bulk created quotes share the same created time, pages must be
+        # split by id.
+        self.quotes = Quote.objects.create_bulk([Quote(phase=phase,
+            user=self.company.admin, deposit_currency=currency)
+            for i in range(25)])
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.company.admin)
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.append([quote['id'] for quote in
+                response.data['data']['results']])
+            url = response.data['data'][link]
+        return ids
+
+    def test_pages_cover_every_row_once(self):
+        pages = self.walk('/api/admin/icos/{}/quotes/?pagination=cursor'
+            '&page_size=10'.format(self.ico.id), 'next')
+
+        expected = sorted((quote.id for quote in self.quotes), reverse=True)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), expected)
+
+        # Walking back from the last page returns the same pages.
+        response = self.client.get('/api/admin/icos/{}/quotes/'
+            '?pagination=cursor&page_size=10'.format(self.ico.id))
+        last = self.client.get(self.client.get(
+            response.data['data']['next']).data['data']['next'])
+        back = self.walk(last.data['data']['previous'], 'previous')
+        self.assertEqual(back, [pages[1], pages[0]])
+
+    def test_cursor_pages_are_validated_by_content(self):
+        url = '/api/admin/icos/{}/quotes/?pagination=cursor'.format(
+            self.ico.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # No aggregate over every quote of the ICO.
+        self.assertFalse([query for query in queries.captured_queries
+            if 'COUNT(' in query['sql'] or 'MAX(' in query['sql']])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        Quote.objects.filter(id=self.quotes[-1].id).update(
+            deposit_amount=Decimal(1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_position_uses_row_comparison(self):
+        queryset = Quote.objects.all()
+        position = (self.quotes[0].created, self.quotes[0].id)
+        sql = str(ResultsSetCursorPagination.filter_position(
+            queryset, '<', position).query)
+
+        self.assertIn('("ico_quote"."created", "ico_quote"."id") <', sql)
+
+
+class ConcurrentPurchaseTests(TransactionTestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company, amount=Decimal(600))
+        phase = Phase.objects.get(ico=self.ico)
+        currency = Currency.objects.get(company=self.company, code='USD')
+        now = datetime.datetime.now(tz=utc)
+
+        users = User.objects.bulk_create([User(identifier=uuid.uuid4(),
+            company=self.company, created=now, updated=now)
+            for i in range(1000)])
+        users = User.objects.filter(company=self.company).exclude(
+            id=self.company.admin_id)
+
+        quotes = Quote.objects.create_bulk([Quote(phase=phase, user=user,
+            deposit_currency=currency, deposit_amount=Decimal(1),
+            token_amount=Decimal(1), rate=Decimal(1)) for user in users])
+
+        Purchase.objects.bulk_create([Purchase(quote=quote,
+            deposit_tx='tx-{}'.format(quote.id),
+            status=PurchaseStatus.PENDING, created=now, updated=now)
+            for quote in quotes])
+
+    def execute(self, purchase):
+        try:
+            return APIClient().post('/api/admin/webhooks/execute/', {
+                'event': 'transaction.execute',
+                'company': self.company.identifier,
+                'data': {
+                    'id': purchase.deposit_tx,
+                    'status': 'Complete',
+                    'tx_type': 'credit',
+                    'currency': {'code': 'USD'},
+                },
+            }, format='json', HTTP_AUTHORIZATION='secret {}'.format(
+                self.company.secret)).status_code
+        finally:
+            connection.close()
+
+    def test_parallel_executes_never_oversell(self):
+        purchases = list(Purchase.objects.all())
+        self.assertEqual(len(purchases), 1000)
+
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            codes = list(executor.map(self.execute, purchases))
+
+        self.assertTrue(all(code == 200 for code in codes))
+
+        ico = Ico.objects.get(id=self.ico.id)
+        sold = Purchase.objects.filter(status=PurchaseStatus.COMPLETE)\
+            .aggregate(total=Sum('quote__token_amount'))['total']
+
+        self.assertEqual(sold, Decimal(600))
+        self.assertEqual(ico.amount_remaining, Decimal(0))
+
+
+class RehiveCommandTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        ico = create_ico(self.company)
+        quote = Quote.objects.create(phase=Phase.objects.get(ico=ico),
+            user=self.company.admin,
+            deposit_currency=Currency.objects.get(company=self.company,
+                code='USD'))
+        self.purchase = Purchase.objects.create(quote=quote,
+            deposit_tx='tx-deposit', status=PurchaseStatus.PENDING)
+
+        self.credit = RehiveCommand.objects.create(purchase=self.purchase,
+            command=CommandType.CREDIT, data={'amount': 100})
+        self.patch = RehiveCommand.objects.create(purchase=self.purchase,
+            command=CommandType.PATCH, data={'status': 'Complete'})
+
+        self.rehive = mock.Mock()
+        self.transactions = self.rehive.admin.transactions
+        self.transactions.create_credit.return_value = {'id': 'tx-token'}
+        self.transactions.get.return_value = []
+
+        patcher = mock.patch('ico.models.get_rehive',
+            return_value=self.rehive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_due(self):
+        RehiveCommand.objects.update(
+            next_attempt=datetime.datetime.now(tz=utc))
+
+    def test_failed_delivery_is_retried(self):
+        self.transactions.create_credit.side_effect = [
+            Exception('Timeout'), {'id': 'tx-token'}]
+
+        self.assertEqual(RehiveCommand.objects.dispatch(), 0)
+        credit = RehiveCommand.objects.get(id=self.credit.id)
+        self.assertEqual(credit.status, CommandStatus.PENDING)
+        self.assertEqual(credit.attempts, 1)
+        self.assertEqual(credit.error, 'Timeout')
+        self.assertGreater(credit.next_attempt,
+            datetime.datetime.now(tz=utc))
+
+        # Nothing is due until the backoff has passed.
+        self.assertEqual(RehiveCommand.objects.dispatch(), 0)
+        self.make_due()
+        self.assertEqual(RehiveCommand.objects.dispatch(), 2)
+
+        credit = RehiveCommand.objects.get(id=self.credit.id)
+        self.assertEqual(credit.status, CommandStatus.COMPLETE)
+        self.assertIsNone(credit.error)
+        self.assertEqual(self.transactions.create_credit.call_count, 2)
+
+    def test_delivery_fails_after_max_attempts(self):
+        self.transactions.create_credit.side_effect = Exception('Timeout')
+        RehiveCommand.objects.filter(id=self.credit.id).update(
+            attempts=settings.OUTBOX_MAX_ATTEMPTS - 1)
+
+        self.assertEqual(RehiveCommand.objects.dispatch(), 0)
+        self.assertEqual(RehiveCommand.objects.get(id=self.credit.id).status,
+            CommandStatus.FAILED)
+
+    def test_redelivery_reuses_the_transaction_of_an_earlier_attempt(self):
+        # The first attempt created the transaction but its response was lost.
+        self.transactions.create_credit.side_effect = Exception('Timeout')
+        RehiveCommand.objects.dispatch()
+        self.make_due()
+
+        reference = str(self.credit.idempotency_key)
+        self.assertEqual(
+            self.transactions.create_credit.call_args[1]['reference'],
+            reference)
+
+        self.transactions.get.return_value = [{'id': 'tx-token'}]
+        self.assertEqual(RehiveCommand.objects.dispatch(), 2)
+
+        self.transactions.get.assert_called_once_with(
+            filters={'reference': reference})
+        self.assertEqual(self.transactions.create_credit.call_count, 1)
+        self.assertEqual(Purchase.objects.get(id=self.purchase.id).token_tx,
+            'tx-token')
+
+    def test_commands_of_a_purchase_are_delivered_in_order(self):
+        self.transactions.create_credit.side_effect = Exception('Timeout')
+
+        RehiveCommand.objects.dispatch()
+        self.make_due()
+        RehiveCommand.objects.dispatch()
+
+        # The patch waits for the credit that creates its transaction.
+        self.assertEqual(RehiveCommand.objects.get(id=self.patch.id).attempts,
+            0)
+        self.assertFalse(self.transactions.patch.called)
+
+        self.transactions.create_credit.side_effect = None
+        self.make_due()
+        self.assertEqual(RehiveCommand.objects.dispatch(), 2)
+        self.transactions.patch.assert_called_once_with('tx-token',
+            'Complete')
+
+
+class WebhookTaskTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company()
+        self.other = create_company(identifier='other_company')
+
+        patcher = mock.patch.object(Purchase.objects, 'initiate_purchase')
+        self.initiate_purchase = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_task(self, company, tx_id):
+        return WebhookTask.objects.create(company=company,
+            event=WebhookEvent.TRANSACTION_INITIATE, data={'id': tx_id})
+
+    def test_tasks_of_a_company_are_processed_in_order(self):
+        first = self.create_task(self.company, 'tx-1')
+        second = self.create_task(self.company, 'tx-2')
+        other = self.create_task(self.other, 'tx-3')
+
+        self.initiate_purchase.side_effect = Exception('Unavailable')
+        self.assertEqual(WebhookTask.objects.process_next(), first)
+
+        # The failed task waits for its retry, the next task of its company
+        # must not overtake it.
+        self.initiate_purchase.side_effect = None
+        self.assertEqual(WebhookTask.objects.process_next(), other)
+        self.assertIsNone(WebhookTask.objects.process_next())
+        self.assertEqual(WebhookTask.objects.get(id=second.id).attempts, 0)
+
+        WebhookTask.objects.filter(id=first.id).update(
+            next_attempt=datetime.datetime.now(tz=utc))
+        self.assertEqual(WebhookTask.objects.process_next(), first)
+        self.assertEqual(WebhookTask.objects.process_next(), second)
+        self.assertEqual(
+            [call[0][1]['id'] for call in
+                self.initiate_purchase.call_args_list],
+            ['tx-1', 'tx-3', 'tx-1', 'tx-2'])
+
+    def test_failed_task_is_rolled_back_and_retried(self):
+        task = self.create_task(self.company, 'tx-1')
+        self.initiate_purchase.side_effect = Exception('Unavailable')
+
+        WebhookTask.objects.process_next()
+
+        task = WebhookTask.objects.get(id=task.id)
+        self.assertEqual(task.status, TaskStatus.PENDING)
+        self.assertEqual(task.attempts, 1)
+        self.assertEqual(task.error, 'Unavailable')
+        self.assertGreater(task.next_attempt, datetime.datetime.now(tz=utc))
+        # The event is not marked as processed by the failed attempt.
+        self.assertFalse(ProcessedEvent.objects.exists())
+
+        self.initiate_purchase.side_effect = None
+        WebhookTask.objects.filter(id=task.id).update(
+            next_attempt=datetime.datetime.now(tz=utc))
+        WebhookTask.objects.process_next()
+
+        task = WebhookTask.objects.get(id=task.id)
+        self.assertEqual(task.status, TaskStatus.COMPLETE)
+        self.assertIsNone(task.error)
+        self.assertIsNotNone(task.processed)
+        self.assertTrue(ProcessedEvent.objects.filter(tx_id='tx-1').exists())
+
+    def test_task_fails_after_max_attempts(self):
+        first = self.create_task(self.company, 'tx-1')
+        second = self.create_task(self.company, 'tx-2')
+        WebhookTask.objects.filter(id=first.id).update(
+            attempts=settings.WEBHOOK_MAX_ATTEMPTS - 1)
+        self.initiate_purchase.side_effect = [Exception('Unavailable'), None]
+
+        self.assertEqual(WebhookTask.objects.process_next(), first)
+        self.assertEqual(WebhookTask.objects.get(id=first.id).status,
+            TaskStatus.FAILED)
+
+        # A failed task no longer holds up its company.
+        self.assertEqual(WebhookTask.objects.process_next(), second)
+
+
+class WebhookTaskLockTests(TransactionTestCase):
+
+    def test_concurrent_workers_claim_disjoint_tasks(self):
+        company = create_company()
+        other = create_company(identifier='other_company')
+        for owner, tx_id in ((company, 'tx-1'), (company, 'tx-2'),
+                (other, 'tx-3')):
+            WebhookTask.objects.create(company=owner,
+                event=WebhookEvent.TRANSACTION_INITIATE, data={'id': tx_id})
+
+        release = threading.Event()
+        tasks = {}
+
+        def claim(worker, claimed):
+            try:
+                with transaction.atomic():
+                    task = WebhookTask.objects.claim()
+                    tasks[worker] = task and task.data['id']
+                    claimed.set()
+                    # Hold the lock like a worker processing the task.
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        threads = []
+        for worker in range(3):
+            claimed = threading.Event()
+            thread = threading.Thread(target=claim, args=(worker, claimed))
+            thread.start()
+            threads.append(thread)
+            claimed.wait(10)
+
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # The locked first task is skipped instead of waited for, and the
+        # second task of its company waits until the first is processed.
+        self.assertEqual(tasks, {0: 'tx-1', 1: 'tx-3', 2: None})
+
+
+class ProcessedEventTests(TransactionTestCase):
+
+    def setUp(self):
+        self.company = create_company()
+        self.data = {'id': 'tx-1'}
+
+        def initiate_purchase(company, data):
+            # Keep the first transaction open while duplicates arrive.
+            time.sleep(0.1)
+
+        patcher = mock.patch.object(Purchase.objects, 'initiate_purchase',
+            side_effect=initiate_purchase)
+        self.initiate_purchase = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def deliver(self):
+        try:
+            WebhookTask.objects.process_event(self.company,
+                WebhookEvent.TRANSACTION_INITIATE, self.data)
+        finally:
+            connection.close()
+
+    def test_redelivered_event_is_processed_once(self):
+        self.deliver()
+        self.deliver()
+
+        self.assertEqual(self.initiate_purchase.call_count, 1)
+        self.assertEqual(ProcessedEvent.objects.count(), 1)
+
+    def test_concurrent_deliveries_are_processed_once(self):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            for future in [executor.submit(self.deliver) for i in range(10)]:
+                future.result()
+
+        self.assertEqual(self.initiate_purchase.call_count, 1)
+        self.assertEqual(ProcessedEvent.objects.count(), 1)
+
+    def test_rolled_back_event_is_processed_again(self):
+        self.initiate_purchase.side_effect = [Exception('Unavailable'), None]
+
+        with self.assertRaises(Exception):
+            self.deliver()
+        self.deliver()
+
+        self.assertEqual(self.initiate_purchase.call_count, 2)
+        self.assertEqual(ProcessedEvent.objects.count(), 1)
+
+
+class FoldInventoryTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company, amount=Decimal(100))
+
+    def test_fold_sums_shards(self):
+        self.ico.set_inventory_shards(4)
+        self.ico.deduct_amount(Decimal(10), key=1)
+
+        self.assertEqual(Ico.objects.fold_inventory(), 1)
+        self.assertEqual(Ico.objects.get(id=self.ico.id).amount_remaining,
+            Decimal(90))
+        self.assertEqual(Ico.objects.fold_inventory(), 0)
+
+    def test_fold_skips_unsharded_icos(self):
+        self.ico.set_inventory_shards(4)
+        self.ico.set_inventory_shards(0)
+        # Stale shards must never overwrite an authoritative amount.
+        IcoShard.objects.create(ico=self.ico, index=0,
+            amount_remaining=Decimal(100))
+        self.ico.deduct_amount(Decimal(10))
+
+        self.assertEqual(Ico.objects.fold_inventory(), 0)
+        self.assertEqual(Ico.objects.get(id=self.ico.id).amount_remaining,
+            Decimal(90))
+
+
+class ShardedDeductionTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company, amount=Decimal(100))
+
+    def test_deduction_after_shards_were_folded(self):
+        self.ico.set_inventory_shards(4)
+        stale = Ico.objects.get(id=self.ico.id)
+        self.ico.set_inventory_shards(0)
+
+        stale.deduct_amount(Decimal(10), key=1)
+
+        self.assertEqual(stale.inventory_shards, 0)
+        self.assertEqual(Ico.objects.get(id=self.ico.id).amount_remaining,
+            Decimal(90))
+
+    def test_deduction_after_inventory_was_sharded(self):
+        stale = Ico.objects.get(id=self.ico.id)
+        self.ico.set_inventory_shards(4)
+
+        stale.deduct_shard_amount(Decimal(10), key=1)
+
+        self.assertEqual(stale.inventory_shards, 4)
+        self.assertEqual(IcoShard.objects.filter(ico=self.ico).aggregate(
+            total=Sum('amount_remaining'))['total'], Decimal(90))
+
+
+class IcoStatusTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+
+    def test_save_does_not_overwrite_status(self):
+        first = create_ico(self.company)
+        stale = Ico.objects.get(id=first.id)
+
+        second = create_ico(self.company, status=IcoStatus.CLOSED)
+        second.set_status(IcoStatus.OPEN)
+
+        stale.max_purchases = 5
+        stale.save()
+
+        first = Ico.objects.get(id=first.id)
+        self.assertEqual(first.status, IcoStatus.CLOSED)
+        self.assertEqual(first.max_purchases, 5)
+        self.assertEqual(Ico.objects.get(id=second.id).status,
+            IcoStatus.OPEN)
+
+
+def linear_get_phase(ico, phases):
+    """
+    The previous `Ico.get_phase`, walking the phases in level order with the
+    percentage of tokens sold.
+    """
+
+    if ico.amount_remaining > 0:
+        perc = ((ico.amount - ico.amount_remaining) / ico.amount) * 100
+
+        for phase in phases:
+            if perc < phase.percentage:
+                return phase
+            else:
+                perc = perc - phase.percentage
+
+    raise Phase.DoesNotExist
+
+
+class IcoPhaseTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company, phases=0, amount=Decimal(7))
+        for level, percentage in enumerate((10, 25, 40, 25), 1):
+            Phase.objects.create(ico=self.ico, level=level,
+                percentage=percentage, base_rate=Decimal(level))
+        self.ico = Ico.objects.get(id=self.ico.id)
+        self.phases = list(Phase.objects.filter(ico=self.ico)
+            .order_by('level'))
+
+    def set_sold(self, sold):
+        self.ico.amount_remaining = self.ico.amount - sold
+        self.ico._phase_bounds = None
+
+    def test_matches_linear_lookup_at_boundaries(self):
+        tiny = Decimal('0.000000000000000001')
+        amounts = [Decimal(0), self.ico.amount - tiny]
+        for row in self.ico.phase_thresholds:
+            threshold = Decimal(row[0])
+            amounts.extend([threshold - tiny, threshold, threshold + tiny])
+
+        for sold in amounts:
+            if sold < 0 or sold >= self.ico.amount:
+                continue
+
+            with self.subTest(sold=sold):
+                self.set_sold(sold)
+                expected = linear_get_phase(self.ico, self.phases)
+                with self.assertNumQueries(0):
+                    phase = self.ico.get_phase()
+                self.assertEqual(phase.id, expected.id)
+                self.assertEqual(phase.level, expected.level)
+                self.assertEqual(phase.base_rate, expected.base_rate)
+
+    def test_sold_out_has_no_phase(self):
+        self.set_sold(self.ico.amount)
+
+        with self.assertRaises(Phase.DoesNotExist):
+            self.ico.get_phase()
+
+    def test_phase_lookup_does_not_write(self):
+        Ico.all_objects.filter(id=self.ico.id).update(phase_thresholds=None)
+        ico = Ico.objects.get(id=self.ico.id)
+
+        with self.assertNumQueries(0), self.assertRaises(Phase.DoesNotExist):
+            ico.get_phase()
+
+    def test_migration_builds_missing_phase_tables(self):
+        migration = importlib.import_module(
+            'ico.migrations.0021_ico_phase_thresholds')
+        expected = self.ico.phase_thresholds
+        Ico.all_objects.filter(id=self.ico.id).update(phase_thresholds=None)
+
+        migration.build_phase_thresholds(apps, None)
+
+        self.assertEqual(Ico.objects.get(id=self.ico.id).phase_thresholds,
+            expected)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company)
+        phase = Phase.objects.get(ico=self.ico)
+        currency = Currency.objects.get(company=self.company, code='USD')
+        self.quotes = Quote.objects.create_bulk([Quote(phase=phase,
+            user=self.company.admin, deposit_currency=currency,
+            deposit_amount=Decimal(i)) for i in range(5)])
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.company.admin)
+
+    @mock.patch('ico.views.AdminQuoteExportView.export_chunk_size', 2)
+    def test_quote_export_streams_every_row(self):
+        response = self.client.get(
+            '/api/admin/icos/{}/quotes/export/'.format(self.ico.id))
+
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'id')
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]],
+            [quote.id for quote in self.quotes])
+        self.assertEqual([int(line.split(',')[4]) for line in lines[1:]],
+            [0, 100, 200, 300, 400])
+
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        self.company = create_company(currencies=2)
+        self.ico = create_ico(self.company)
+        phase = Phase.objects.get(ico=self.ico)
+        currency = Currency.objects.get(company=self.company, code='USD')
+        now = datetime.datetime.now(tz=utc)
+
+        quotes = Quote.objects.create_bulk([Quote(phase=phase,
+            user=self.company.admin, deposit_currency=currency,
+            deposit_amount=Decimal(2), token_amount=Decimal(1),
+            rate=Decimal(2)) for i in range(3)])
+        Purchase.objects.bulk_create([Purchase(quote=quote,
+            deposit_tx='tx-{}'.format(quote.id),
+            status=PurchaseStatus.PENDING, created=now, updated=now)
+            for quote in quotes])
+
+        for purchase in Purchase.objects.all():
+            Purchase.objects.update_purchase(purchase, 'Complete')
+
+    def get_rollups(self):
+        return sorted(SalesRollup.objects.filter(ico=self.ico).values_list(
+            'kind', 'key', 'purchase_count', 'token_total', 'deposit_total'),
+            key=lambda row: (row[0].value, row[1]))
+
+    def test_completions_are_folded_outside_the_purchase(self):
+        self.assertFalse(SalesRollup.objects.exists())
+
+        self.assertEqual(SalesRollup.objects.fold(), 3)
+        self.assertEqual(SalesRollup.objects.fold(), 0)
+
+        total = SalesRollup.objects.get(ico=self.ico, kind=RollupKind.ICO)
+        self.assertEqual(total.purchase_count, 3)
+        self.assertEqual(total.token_total, Decimal(3))
+        currency = SalesRollup.objects.get(ico=self.ico,
+            kind=RollupKind.CURRENCY)
+        self.assertEqual(currency.deposit_total, Decimal(6))
+
+    def test_rebuild_buckets_by_completion_time(self):
+        SalesRollup.objects.fold(batch_size=2)
+        SalesRollup.objects.fold(batch_size=2)
+        folded = self.get_rollups()
+
+        # Later updates, eg. the token transaction id, must not move the
+        # purchases to another minute.
+        Purchase.objects.update(updated=datetime.datetime.now(tz=utc)
+            + datetime.timedelta(hours=1))
+
+        self.assertEqual(SalesRollup.objects.rebuild(self.ico), 3)
+        self.assertFalse(SalesRollup.objects.filter(ico=self.ico).exists())
+        SalesRollup.objects.fold()
+
+        self.assertEqual(self.get_rollups(), folded)
@@ -10,6 +10,9 @@ urlpatterns = (
     url(r'^icos/$', views.IcoList.as_view(), name='icos'),
     url(r'^icos/(?P<ico_id>\d+)/$', views.IcoView.as_view(), name='icos-view'),
 
+    # Served by the stream deployment, see config/gunicorn_stream.py.
+    url(r'^stream/icos/(?P<ico_id>\d+)/$', views.IcoStreamView.as_view(), name='icos-stream'),
+
     url(r'^admin/webhooks/initiate/$', views.AdminTransactionInitiateWebhookView.as_view(), name='admin-webhooks-initiate'),
     url(r'^admin/webhooks/execute/$', views.AdminTransactionExecuteWebhookView.as_view(), name='admin-webhooks-execute'),
     url(r'^admin/company/$', views.AdminCompanyView.as_view(), name='admin-company'),
@@ -17,13 +20,17 @@ urlpatterns = (
     url(r'^admin/currencies/(?P<code>(\w+))/$', views.AdminCurrencyView.as_view(), name='admin-currencies-view'),
     url(r'^admin/icos/$', views.AdminIcoList.as_view(), name='admin-icos'),
     url(r'^admin/icos/(?P<ico_id>\d+)/$', views.AdminIcoView.as_view(), name='admin-icos-view'),
+    url(r'^admin/icos/(?P<ico_id>\d+)/stats/$', views.AdminIcoStatsView.as_view(), name='admin-icos-stats'),
+    url(r'^admin/icos/(?P<ico_id>\d+)/stats/series/$', views.AdminIcoSalesSeriesView.as_view(), name='admin-icos-stats-series'),
     url(r'^admin/icos/(?P<ico_id>\d+)/phases/$', views.AdminPhaseList.as_view(), name='admin-phases'),
     url(r'^admin/icos/(?P<ico_id>\d+)/phases/(?P<phase_id>\d+)/$', views.AdminPhaseView.as_view(), name='admin-phases-view'),
     url(r'^admin/icos/(?P<ico_id>\d+)/phases/(?P<phase_id>\d+)/rates/$', views.AdminRateList.as_view(), name='admin-rates'),
     url(r'^admin/icos/(?P<ico_id>\d+)/phases/(?P<phase_id>\d+)/rates/(?P<rate_id>\d+)/$', views.AdminRateView.as_view(), name='admin-rates-view'),
     url(r'^admin/icos/(?P<ico_id>\d+)/quotes/$', views.AdminQuoteList.as_view(), name='admin-quotes'),
+    url(r'^admin/icos/(?P<ico_id>\d+)/quotes/export/$', views.AdminQuoteExportView.as_view(), name='admin-quotes-export'),
     url(r'^admin/icos/(?P<ico_id>\d+)/quotes/(?P<quote_id>\d+)/$', views.AdminQuoteView.as_view(), name='admin-quotes-view'),
     url(r'^admin/icos/(?P<ico_id>\d+)/purchases/$', views.AdminPurchaseList.as_view(), name='admin-purchases'),
+    url(r'^admin/icos/(?P<ico_id>\d+)/purchases/export/$', views.AdminPurchaseExportView.as_view(), name='admin-purchases-export'),
     url(r'^admin/icos/(?P<ico_id>\d+)/purchases/(?P<purchase_id>\d+)/$', views.AdminPurchaseView.as_view(), name='admin-purchases-view'),
 
     url(r'^user/icos/$', views.UserIcoList.as_view(), name='user-icos'),
@@ -0,0 +1,259 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from ico.utils.events import notify_ico_changes
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+# Cache keys
+# ================
+CATALOGUE_VERSION_KEY = 'ico_service_catalogue_version'
+ICO_VERSION_KEY = 'ico_service_ico_version_{}'
+RESPONSE_CACHE_KEY = 'ico_service_response_{}'
+
+# Seconds a rendered response is kept in the cache.
+RESPONSE_TTL = 300
+# Versions are kept in process memory for this long before they are read
+# from the shared cache again, versions bumped by the process itself are
+# updated immediately.
+LOCAL_VERSION_TTL = 2
+# Number of rendered responses kept in process memory.
+LOCAL_RESPONSE_ENTRIES = 200
+
+# In-process caches of (expires, version) per version key and of
+# (expires, data) per response key.
+_local_versions = {}
+_local_responses = OrderedDict()
+_local_lock = threading.Lock()
+
+# Version bump waiting for the commit of the current transaction, per thread.
+_pending = threading.local()
+
+
+def bump_ico_versions(*ico_ids):
+    """
+    Invalidate the cached public responses of the ICOs and the ICO catalogue
+    once the current transaction is committed, and notify the watchers of
+    the ICOs. The ICOs bumped during a transaction are collected and handled
+    together after the commit, so committing does not wait for the database
+    wide lock Postgres holds while a transaction that notified commits.
+    """
+
+    connection = transaction.get_connection()
+    pending = getattr(_pending, 'bump', None)
+
+    # The hook is dropped when its transaction or savepoint is rolled back.
+    # ICOs bumped in a savepoint that is rolled back while the hook is kept
+    # are still refreshed, which is harmless.
+    if pending is not None and any(func is pending
+            for sids, func in connection.run_on_commit):
+        pending.ico_ids.update(ico_ids)
+        return
+
+    def bump():
+        _bump_versions(bump.ico_ids)
+
+    bump.ico_ids = set(ico_ids)
+    _pending.bump = bump
+    transaction.on_commit(bump)
+
+
+def _bump_versions(ico_ids):
+    versions = {ICO_VERSION_KEY.format(ico_id): uuid.uuid4().hex
+        for ico_id in ico_ids}
+    versions[CATALOGUE_VERSION_KEY] = uuid.uuid4().hex
+    cache.set_many(versions, None)
+    _set_local_versions(versions)
+
+    try:
+        notify_ico_changes(*ico_ids)
+    except DatabaseError as exc:
+        # The changes are committed, watchers catch up when the listener
+        # reconnects.
+        logger.exception(exc)
+
+
+def _set_local_versions(versions):
+    expires = time.time() + LOCAL_VERSION_TTL
+    with _local_lock:
+        for key, version in versions.items():
+            _local_versions[key] = (expires, version)
+
+
+def get_versions(keys):
+    """
+    Get the current versions for the version keys, from process memory if
+    they were read recently. Missing versions are initialized, a missing
+    version can never match a cached response.
+    """
+
+    now = time.time()
+    with _local_lock:
+        versions = {key: _local_versions[key][1] for key in keys
+            if key in _local_versions and _local_versions[key][0] > now}
+
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        fetched = cache.get_many(missing)
+
+        for key in missing:
+            if key not in fetched:
+                cache.add(key, uuid.uuid4().hex, None)
+                fetched[key] = cache.get(key)
+
+        _set_local_versions(fetched)
+        versions.update(fetched)
+
+    return [versions[key] for key in keys]
+
+
+def _get_response_data(key):
+    """
+    Get rendered response data from process memory or the shared cache.
+    """
+
+    now = time.time()
+    with _local_lock:
+        entry = _local_responses.get(key)
+        if entry is not None and entry[0] > now:
+            _local_responses.move_to_end(key)
+            return entry[1]
+
+    data = cache.get(RESPONSE_CACHE_KEY.format(key))
+    if data is not None:
+        _set_response_data(key, data, store=False)
+    return data
+
+
+def _set_response_data(key, data, store=True):
+    if store:
+        cache.set(RESPONSE_CACHE_KEY.format(key), data, RESPONSE_TTL)
+
+    with _local_lock:
+        _local_responses[key] = (time.time() + RESPONSE_TTL, data)
+        _local_responses.move_to_end(key)
+        while len(_local_responses) > LOCAL_RESPONSE_ENTRIES:
+            _local_responses.popitem(last=False)
+
+
+def _request_key(request, *validators):
+    """
+    Hash the parts of a request that change its response together with the
+    validators of the response data.
+    """
+
+    return hashlib.md5(repr((
+        request.path,
+        sorted(request.query_params.lists()),
+        request.accepted_renderer.format,
+    ) + validators).encode('utf-8')).hexdigest()
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def cached_response(request, version_keys, render):
+    """
+    Serve response data from the cache, keyed by the request path, query
+    parameters, format and the current versions of the version keys. The
+    same key is used as ETag so that clients sending a matching
+    If-None-Match header get a 304 without the response being rendered.
+    Recently used versions and responses are kept in process memory, so
+    304s and cache hits usually do not touch the shared cache.
+    """
+
+    key = _request_key(request, get_versions(version_keys))
+    etag = '"{}"'.format(key)
+
+    if _etag_matches(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED,
+            headers={'ETag': etag})
+
+    data = _get_response_data(key)
+
+    if data is None:
+        response = render()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+
+        data = response.data
+        _set_response_data(key, data)
+
+    return Response(data, headers={'ETag': etag})
+
+
+def content_conditional_response(request, render):
+    """
+    Answer conditional GET requests with an ETag of the rendered response
+    data. Used where validators of the whole queryset would cost more than
+    the response itself, the response is still rendered but not sent if the
+    client already has it.
+    """
+
+    response = render()
+    if response.status_code != status.HTTP_200_OK:
+        return response
+
+    etag = '"{}"'.format(_request_key(request, repr(response.data)))
+    if _etag_matches(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED,
+            headers={'ETag': etag})
+
+    response['ETag'] = etag
+    return response
+
+
+def conditional_response(request, queryset, related, render):
+    """
+    Answer conditional GET requests before the response is rendered. The ETag
+    and Last-Modified validators are computed with a single aggregate of the
+    row count and the most recent `updated` values of the queryset and of
+    the related objects that are part of its representation.
+    """
+
+    fields = ['updated'] + ['{}__updated'.format(name) for name in related]
+    aggregates = {'count': Count('id', distinct=True)}
+    for i, field in enumerate(fields):
+        aggregates['updated_{}'.format(i)] = Max(field)
+
+    values = queryset.order_by().aggregate(**aggregates)
+    updated = tuple(values['updated_{}'.format(i)] for i in range(len(fields)))
+    last_modified = max([value for value in updated if value] or [None])
+
+    etag = '"{}"'.format(_request_key(request, values['count'], updated))
+    headers = {'ETag': etag}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified.timestamp())
+
+    if 'HTTP_IF_NONE_MATCH' in request.META:
+        not_modified = _etag_matches(request, etag)
+    else:
+        modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        not_modified = bool(last_modified and modified_since
+            and int(last_modified.timestamp()) <= modified_since)
+
+    if not_modified:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response = render()
+    if response.status_code == status.HTTP_200_OK:
+        for key, value in headers.items():
+            response[key] = value
+
+    return response
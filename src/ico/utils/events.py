@@ -0,0 +1,252 @@
+import os
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+# Postgres channel on which the ids of changed ICOs are published.
+ICO_CHANGES_CHANNEL = 'ico_service_ico_changes'
+
+# Seconds the listener waits before reconnecting after an error.
+LISTENER_RETRY_DELAY = 5
+
+# Per-process listener, restarted if the process is forked.
+_listener = None
+_listener_pid = None
+
+# Channels of the ICOs watched in this process, by ICO id.
+_channels = {}
+_lock = threading.Lock()
+
+# Limits the database connections opened by watchers in this process, the
+# listener has its own.
+_loads = threading.BoundedSemaphore(settings.ICO_STREAM_DB_CONNECTIONS)
+
+
+def notify_ico_changes(*ico_ids):
+    """
+    Publish the ids of ICOs whose public state changed. Postgres delivers the
+    notification to listeners once the current transaction is committed, and
+    drops it if the transaction is rolled back.
+    """
+
+    if not ico_ids:
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [ICO_CHANGES_CHANNEL,
+            ','.join(str(ico_id) for ico_id in sorted(set(ico_ids)))])
+
+
+class IcoChannel(object):
+    """
+    Latest public state of an ICO, shared by every watcher of the ICO in this
+    process. The version is increased whenever a new state is published, a
+    state of None means the ICO is no longer public.
+    """
+
+    def __init__(self, ico_id):
+        self.ico_id = ico_id
+        self.condition = threading.Condition(_lock)
+        self.watchers = 0
+        self.version = 0
+        self.payload = None
+
+    def publish(self, payload):
+        with self.condition:
+            self.version += 1
+            self.payload = payload
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        """
+        Wait until a state newer than the version is published. Returns the
+        current version and state.
+        """
+        with self.condition:
+            if self.version == version:
+                self.condition.wait(timeout)
+            return self.version, self.payload
+
+
+class IcoChangeListener(threading.Thread):
+    """
+    Listen for ICO change notifications on a dedicated database connection.
+    The state of each changed ICO that is watched in this process is loaded
+    once and published to all its watchers. Notifications that arrive
+    together are loaded with a single query.
+    """
+
+    daemon = True
+
+    def __init__(self, load):
+        super(IcoChangeListener, self).__init__(name='ico-change-listener')
+        self.load = load
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception as exc:
+                logger.exception(exc)
+                connection.close()
+                time.sleep(LISTENER_RETRY_DELAY)
+
+    def listen(self):
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("LISTEN {}".format(ICO_CHANGES_CHANNEL))
+
+        # Changes may have been missed while the listener was disconnected.
+        with _lock:
+            ico_ids = set(_channels)
+        self.refresh(ico_ids)
+
+        conn = connection.connection
+        while True:
+            # Notifications are also received while other queries run on the
+            # connection, select() would not report them.
+            self.drain(conn)
+
+            if select.select([conn], [], [], settings.ICO_STREAM_KEEPALIVE) \
+                    == ([], [], []):
+                # Make sure the connection is still alive.
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                continue
+
+            conn.poll()
+
+    def drain(self, conn):
+        """
+        Refresh the ICOs of all received notifications, until no more are
+        received while refreshing.
+        """
+
+        while conn.notifies:
+            ico_ids = set()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                ico_ids.update(int(i) for i in notify.payload.split(','))
+
+            self.refresh(ico_ids)
+
+    def refresh(self, ico_ids):
+        with _lock:
+            channels = [_channels[ico_id] for ico_id in ico_ids
+                if ico_id in _channels]
+
+        if not channels:
+            return
+
+        payloads = self.load([channel.ico_id for channel in channels])
+        for channel in channels:
+            channel.publish(payloads.get(channel.ico_id))
+
+
+def get_listener(load):
+    """
+    Get the ICO change listener of the current process, starting it if
+    needed. The load function takes a list of ICO ids and returns the public
+    state of each public ICO by id.
+    """
+    global _listener, _listener_pid
+
+    pid = os.getpid()
+    if _listener is None or _listener_pid != pid:
+        with _lock:
+            if _listener is None or _listener_pid != pid:
+                _listener = IcoChangeListener(load)
+                _listener.start()
+                _listener_pid = pid
+
+    return _listener
+
+
+def subscribe(ico_id, load):
+    """
+    Watch an ICO. Returns the channel of the ICO with its current state, the
+    state is only loaded if the ICO is not watched yet. At most
+    ICO_STREAM_DB_CONNECTIONS states are loaded at once per process.
+    """
+
+    get_listener(load)
+
+    with _lock:
+        channel = _channels.get(ico_id)
+        if channel is None:
+            channel = _channels[ico_id] = IcoChannel(ico_id)
+        channel.watchers += 1
+        loaded = channel.version > 0
+
+    if not loaded:
+        try:
+            with _loads:
+                try:
+                    payload = load([ico_id]).get(ico_id)
+                finally:
+                    # The stream does not use the database, do not keep a
+                    # connection open for its whole duration.
+                    connection.close()
+        except Exception:
+            unsubscribe(channel)
+            raise
+
+        with _lock:
+            # Keep the state if the listener published a newer one meanwhile.
+            if channel.version == 0:
+                channel.version = 1
+                channel.payload = payload
+
+    return channel
+
+
+def unsubscribe(channel):
+    """
+    Stop watching an ICO, its channel is dropped with the last watcher.
+    """
+
+    with _lock:
+        channel.watchers -= 1
+        if channel.watchers == 0 and \
+                _channels.get(channel.ico_id) is channel:
+            del _channels[channel.ico_id]
+
+
+def stream(channel):
+    """
+    Generate server-sent events with the state of a watched ICO. The current
+    state is sent first and then every new state, with a comment sent as
+    keep-alive when nothing changed. Streams end after ICO_STREAM_MAX_AGE
+    seconds, clients reconnect automatically.
+    """
+
+    deadline = time.time() + settings.ICO_STREAM_MAX_AGE
+    version = 0
+
+    try:
+        yield 'retry: {}\n\n'.format(settings.ICO_STREAM_RETRY * 1000)
+
+        while time.time() < deadline:
+            current, payload = channel.wait(version,
+                settings.ICO_STREAM_KEEPALIVE)
+
+            if current == version:
+                yield ': keepalive\n\n'
+                continue
+
+            version = current
+            if payload is None:
+                yield 'event: closed\ndata: {}\n\n'
+                return
+
+            yield 'data: {}\n\n'.format(payload)
+    finally:
+        unsubscribe(channel)
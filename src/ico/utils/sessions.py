@@ -0,0 +1,141 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from django.conf import settings
+from rehive import Rehive
+
+from logging import getLogger
+
+logger = getLogger('django')
+
+
+# Per-process session, recreated if the process is forked.
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter with a default timeout that keeps count of how its
+    connection pools are used:
+
+    in_use: requests currently holding a connection of the host pool.
+    peak: most connections of the host pool that were in use at once.
+    waits: requests that found every connection of the host pool in use.
+    connections: connections that were opened to the host by its pool.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        super(PooledHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        url = urlparse(request.url)
+        host = '{}://{}'.format(url.scheme, url.netloc)
+
+        with self._stats_lock:
+            stats = self._stats.setdefault(host,
+                {'requests': 0, 'in_use': 0, 'peak': 0, 'waits': 0})
+            if stats['in_use'] >= self._pool_maxsize:
+                stats['waits'] += 1
+                logger.warning(
+                    "HTTP connection pool for {} is exhausted.".format(host))
+            stats['requests'] += 1
+            stats['in_use'] += 1
+            stats['peak'] = max(stats['peak'], stats['in_use'])
+
+        try:
+            return super(PooledHTTPAdapter, self).send(request, **kwargs)
+        finally:
+            with self._stats_lock:
+                stats['in_use'] -= 1
+
+    def get_stats(self):
+        """
+        Get the usage counters of every host pool.
+        """
+        connections = {}
+        for key in self.poolmanager.pools.keys():
+            pool = self.poolmanager.pools.get(key)
+            if pool is not None:
+                host = '{}://{}:{}'.format(pool.scheme, pool.host, pool.port)
+                connections[host] = pool.num_connections
+
+        with self._stats_lock:
+            result = {}
+            for host, stats in self._stats.items():
+                url = urlparse(host)
+                port = url.port or (443 if url.scheme == 'https' else 80)
+                opened = connections.get('{}://{}:{}'.format(
+                    url.scheme, url.hostname, port), 0)
+                result[host] = dict(stats, connections=opened)
+
+        return result
+
+
+def _create_session():
+    session = requests.Session()
+    # The session is shared by requests made for different tokens, so it
+    # must never send back cookies it received for another one.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    retries = Retry(
+        total=settings.HTTP_RETRIES,
+        backoff_factor=settings.HTTP_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False)
+    adapter = PooledHTTPAdapter(
+        timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT),
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+        max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def get_session():
+    """
+    Get the connection pooled session of the current process. Connections
+    are kept alive between requests so that outbound calls do not pay for a
+    new TCP and TLS handshake each time.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _create_session()
+                _session_pid = pid
+
+    return _session
+
+
+def get_pool_stats():
+    """
+    Get the connection pool counters of the current process per host.
+    """
+    return get_session().get_adapter('https://').get_stats()
+
+
+def get_rehive(token):
+    """
+    Get a Rehive SDK instance that makes its requests with the pooled
+    session.
+    """
+    rehive = Rehive(token)
+    rehive.client._session = get_session()
+    return rehive
@@ -1,18 +1,35 @@
+import csv
+import json
+import base64
+import datetime
 from collections import OrderedDict
+from itertools import chain
+
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import utc
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 from rest_framework import exceptions, status, filters
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.utils.urls import replace_query_param
 
 from ico.models import *
 from ico.serializers import *
 from ico.authentication import *
-from ico.enums import IcoStatus
+from ico.enums import IcoStatus, RollupKind
+from ico.utils import events
+from ico.utils.cache import (
+    cached_response, conditional_response, content_conditional_response,
+    CATALOGUE_VERSION_KEY, ICO_VERSION_KEY
+)
 
 from logging import getLogger
 
@@ -84,6 +101,155 @@ class ResultsSetPagination(PageNumberPagination):
         return Response(OrderedDict([('status', 'success'), ('data', response)]))
 
 
+class ResultsSetCursorPagination(BasePagination):
+    """
+    Keyset pagination ordered by (created, id), newest first. Pages are
+    found with a range condition on the (created, id) index instead of an
+    OFFSET scan. The total count is only included when requested with
+    `count=exact`, or `count=estimate` for the query planner's estimate.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 250
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = self.get_count(queryset, request)
+        reverse, position = self.decode_cursor(request)
+
+        if reverse:
+            queryset = queryset.order_by('created', 'id')
+            if position:
+                queryset = self.filter_position(queryset, '>', position)
+        else:
+            queryset = queryset.order_by('-created', '-id')
+            if position:
+                queryset = self.filter_position(queryset, '<', position)
+
+        results = list(queryset[:self.page_size + 1])
+        page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = page
+        return page
+
+    @staticmethod
+    def filter_position(queryset, operator, position):
+        """
+        Filter the rows after the position with a row comparison, which
+        Postgres uses as a range condition on the (created, id) index.
+        """
+
+        table = queryset.model._meta.db_table
+        return queryset.extra(where=[
+            '("{0}"."created", "{0}"."id") {1} (%s, %s)'.format(
+                table, operator)], params=list(position))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param)
+
+        if count == 'exact':
+            return queryset.count()
+        elif count == 'estimate':
+            return self.estimate_count(queryset)
+
+    @staticmethod
+    def estimate_count(queryset):
+        """
+        Get the number of rows the query planner estimates for the queryset.
+        """
+
+        sql, params = queryset.query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+
+        try:
+            direction, created, obj_id = base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('ascii').split('|')
+            position = (parse_datetime(created), int(obj_id))
+        except (TypeError, ValueError):
+            raise exceptions.NotFound('Invalid cursor')
+
+        if direction not in ('n', 'p') or position[0] is None:
+            raise exceptions.NotFound('Invalid cursor')
+
+        return direction == 'p', position
+
+    def encode_cursor(self, direction, obj):
+        encoded = base64.urlsafe_b64encode('{}|{}|{}'.format(direction,
+            obj.created.isoformat(), obj.id).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param,
+            encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor('n', self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor('p', self.page[0])
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ])
+
+        return Response(OrderedDict([('status', 'success'), ('data', response)]))
+
+
+class CursorPaginationMixin(object):
+    """
+    Paginate with keyset cursors instead of page numbers when requested with
+    `pagination=cursor`.
+    """
+
+    cursor_pagination_class = ResultsSetCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            else:
+                return super(CursorPaginationMixin, self).paginator
+        return self._paginator
+
+
 class ListModelMixin(object):
     """
     List a queryset.
@@ -111,6 +277,147 @@ class ListAPIView(ListModelMixin,
         return self.list(request, *args, **kwargs)
 
 
+class RetrieveAPIView(GenericAPIView):
+    """
+    Concrete view for retrieving an object.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return self.retrieve(request, *args, **kwargs)
+
+
+class ConditionalGetMixin(object):
+    """
+    Answer conditional GET requests (If-None-Match/If-Modified-Since) with a
+    304 before the response is serialized. Validators are computed from the
+    row count and most recent `updated` values of the validator queryset and
+    the `validator_related` objects included in the response. Cursor pages
+    are validated by their content instead, so that they never aggregate
+    every row of the queryset.
+    """
+
+    validator_related = ()
+
+    def get_validator_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def get(self, request, *args, **kwargs):
+        def render():
+            return super(ConditionalGetMixin, self).get(
+                request, *args, **kwargs)
+
+        if isinstance(self.paginator, ResultsSetCursorPagination):
+            return content_conditional_response(request, render)
+
+        return conditional_response(request, self.get_validator_queryset(),
+            self.validator_related, render)
+
+
+def parse_date(value):
+    """
+    Parse a date query parameter given as a millisecond timestamp or an ISO
+    8601 date.
+    """
+
+    if value.isdigit():
+        return datetime.datetime.fromtimestamp(int(value) / 1000, tz=utc)
+
+    try:
+        date = parse_datetime(value)
+    except ValueError:
+        date = None
+
+    if date is None:
+        raise exceptions.ValidationError(
+            {"non_field_errors": ["Invalid date: {}".format(value)]})
+
+    return date
+
+
+class Echo(object):
+    """
+    File-like object that returns what is written to it, so that a csv
+    writer can format rows for a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+class ExportMixin(object):
+    """
+    Stream every row of the export queryset as CSV (default) or NDJSON
+    (`type=ndjson`), optionally filtered on `created__gte`/`created__lt`
+    (millisecond timestamps or ISO 8601 dates).
+
+    Rows are read in keyset chunks ordered by id and formatted by a
+    generator, so memory use is constant whatever the number of rows. The
+    first export field must be the id.
+    """
+
+    allowed_methods = ('GET',)
+    export_chunk_size = 2000
+    export_fields = ()
+    export_name = 'export'
+
+    def get_export_queryset(self):
+        """
+        Get a values_list queryset with the id as first value. Defaults to
+        the `export_fields` of the view queryset.
+        """
+        return self.get_queryset().values_list(*self.export_fields)
+
+    def format_export_row(self, row):
+        return row
+
+    def filter_export_queryset(self, queryset):
+        for lookup in ('created__gte', 'created__lt',):
+            value = self.request.query_params.get(lookup)
+            if value:
+                queryset = queryset.filter(**{lookup: parse_date(value)})
+
+        return queryset
+
+    def iter_export_rows(self, queryset):
+        last_id = 0
+
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).order_by('id')[
+                :self.export_chunk_size])
+
+            for row in rows:
+                yield self.format_export_row(row)
+
+            if len(rows) < self.export_chunk_size:
+                return
+
+            last_id = rows[-1][0]
+
+    def get(self, request, *args, **kwargs):
+        export_type = request.query_params.get('type', 'csv')
+        if export_type not in ('csv', 'ndjson',):
+            raise exceptions.ValidationError(
+                {"non_field_errors": ["Invalid export type."]})
+
+        rows = self.iter_export_rows(
+            self.filter_export_queryset(self.get_export_queryset()))
+
+        if export_type == 'csv':
+            writer = csv.writer(Echo())
+            content = chain([writer.writerow(self.export_fields)],
+                (writer.writerow(row) for row in rows))
+            content_type = 'text/csv'
+        else:
+            content = (json.dumps(OrderedDict(zip(self.export_fields, row)))
+                + '\n' for row in rows)
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = \
+            'attachment; filename="{}.{}"'.format(self.export_name, export_type)
+        return response
+
+
 class ActivateView(GenericAPIView):
     """
     Activate a company in the ICO service. A secret key is created on
@@ -148,7 +455,7 @@ class DeactivateView(GenericAPIView):
 
 class IcoList(ListAPIView):
     """
-    List public ICOs
+    List public ICOs. Responses are cached until any ICO changes.
     """
 
     allowed_methods = ('GET',)
@@ -158,13 +465,19 @@ class IcoList(ListAPIView):
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('id', 'status', 'company__identifier', 'currency__code',)
 
+    def get(self, request, *args, **kwargs):
+        return cached_response(request, [CATALOGUE_VERSION_KEY],
+            lambda: self.list(request, *args, **kwargs))
+
     def get_queryset(self):
-        return Ico.objects.exclude(status=IcoStatus.HIDDEN).filter(public=True)
+        return Ico.objects.exclude(status=IcoStatus.HIDDEN).filter(
+            public=True).select_related('company', 'currency',
+                'base_currency')
 
 
 class IcoView(GenericAPIView):
     """
-    View public ICOs.
+    View public ICOs. Responses are cached until the ICO changes.
     """
 
     allowed_methods = ('GET',)
@@ -172,6 +485,11 @@ class IcoView(GenericAPIView):
     serializer_class = IcoSerializer
 
     def get(self, request, *args, **kwargs):
+        return cached_response(request,
+            [ICO_VERSION_KEY.format(kwargs['ico_id'])],
+            lambda: self.retrieve(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
         ico_id = kwargs['ico_id']
 
         try:
@@ -184,6 +502,54 @@ class IcoView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
+def load_ico_states(ico_ids):
+    """
+    Render the public state of the public ICOs, by id.
+    """
+
+    icos = Ico.objects.exclude(status=IcoStatus.HIDDEN).filter(public=True,
+        id__in=ico_ids).select_related('company', 'currency', 'base_currency')
+
+    return {ico.id: JSONRenderer().render(IcoSerializer(ico).data).decode()
+        for ico in icos}
+
+
+class EventStreamRenderer(JSONRenderer):
+    """
+    Accept requests for server-sent events. Error responses are rendered as
+    JSON.
+    """
+
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+
+class IcoStreamView(APIView):
+    """
+    Stream the public state of an ICO as server-sent events. A new event is
+    sent whenever the ICO changes.
+    """
+
+    allowed_methods = ('GET',)
+    authentication_classes = ()
+    permission_classes = (AllowAny, )
+    renderer_classes = (JSONRenderer, EventStreamRenderer,)
+
+    def get(self, request, *args, **kwargs):
+        channel = events.subscribe(int(kwargs['ico_id']), load_ico_states)
+
+        if channel.payload is None:
+            events.unsubscribe(channel)
+            raise exceptions.NotFound()
+
+        response = StreamingHttpResponse(events.stream(channel),
+            content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Disable response buffering of nginx proxies.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
 class AdminTransactionInitiateWebhookView(GenericAPIView):
     """
     Receive a initiate webhook event. Authenticates requests using a secret in 
@@ -241,7 +607,7 @@ class AdminCompanyView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class AdminCurrencyList(ListAPIView):
+class AdminCurrencyList(ConditionalGetMixin, ListAPIView):
     """
     List and create ICOs.
     """
@@ -263,7 +629,7 @@ class AdminCurrencyList(ListAPIView):
     # refresh URL?
 
 
-class AdminCurrencyView(GenericAPIView):
+class AdminCurrencyView(ConditionalGetMixin, RetrieveAPIView):
     """
     View currency.
     """
@@ -272,7 +638,12 @@ class AdminCurrencyView(GenericAPIView):
     serializer_class = CurrencySerializer
     authentication_classes = (AdminAuthentication,)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Currency.objects.filter(company=company,
+            code__iexact=self.kwargs['code'])
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         code = kwargs['code']
 
@@ -285,7 +656,7 @@ class AdminCurrencyView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class AdminIcoList(ListAPIView):
+class AdminIcoList(ConditionalGetMixin, ListAPIView):
     """
     List and create ICOs.
     """
@@ -294,6 +665,7 @@ class AdminIcoList(ListAPIView):
     pagination_class = ResultsSetPagination
     serializer_class = AdminIcoSerializer
     authentication_classes = (AdminAuthentication,)
+    validator_related = ('phase',)
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('id', 'status', 'currency__code',)
 
@@ -304,7 +676,8 @@ class AdminIcoList(ListAPIView):
 
     def get_queryset(self):
         company = self.request.user.company
-        return Ico.objects.filter(company=company).order_by('-created')
+        return Ico.objects.filter(company=company).select_related('currency',
+            'base_currency').order_by('-created')
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -317,7 +690,7 @@ class AdminIcoList(ListAPIView):
                          status=status.HTTP_201_CREATED)
 
 
-class AdminIcoView(GenericAPIView):
+class AdminIcoView(ConditionalGetMixin, RetrieveAPIView):
     """
     View, update and delete ICOs.
     """
@@ -325,13 +698,18 @@ class AdminIcoView(GenericAPIView):
     allowed_methods = ('GET', 'PATCH', 'DELETE',)
     serializer_class = AdminIcoSerializer
     authentication_classes = (AdminAuthentication,)
+    validator_related = ('phase',)
 
     def get_serializer_class(self):
         if self.request.method in ('PUT', 'PATCH'):
             return AdminUpdateIcoSerializer
         return super(AdminIcoView, self).get_serializer_class()
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Ico.objects.filter(company=company, id=self.kwargs['ico_id'])
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         ico_id = kwargs['ico_id']
 
@@ -373,7 +751,84 @@ class AdminIcoView(GenericAPIView):
         return Response({'status': 'success'})
 
 
-class AdminPhaseList(ListAPIView):
+class AdminIcoStatsView(GenericAPIView):
+    """
+    View the sales of an ICO in total, per phase and per deposit currency.
+    """
+
+    allowed_methods = ('GET',)
+    authentication_classes = (AdminAuthentication,)
+
+    def get(self, request, *args, **kwargs):
+        company = request.user.company
+
+        try:
+            ico = Ico.objects.select_related('currency').get(company=company,
+                id=kwargs['ico_id'])
+        except Ico.DoesNotExist:
+            raise exceptions.NotFound()
+
+        rollups = {kind: [] for kind in RollupKind}
+        for rollup in SalesRollup.objects.filter(ico=ico).exclude(
+                kind=RollupKind.MINUTE).select_related('phase', 'currency'):
+            rollup.ico = ico
+            rollups[rollup.kind].append(rollup)
+
+        if rollups[RollupKind.ICO]:
+            data = AdminSalesRollupSerializer(rollups[RollupKind.ICO][0]).data
+        else:
+            data = {'purchase_count': 0, 'token_total': 0}
+
+        data['phases'] = AdminPhaseSalesSerializer(sorted(
+            rollups[RollupKind.PHASE], key=lambda r: r.phase.level),
+            many=True).data
+        data['currencies'] = AdminCurrencySalesSerializer(
+            rollups[RollupKind.CURRENCY], many=True).data
+
+        return Response({'status': 'success', 'data': data})
+
+
+class AdminIcoSalesSeriesView(GenericAPIView):
+    """
+    View the sales of an ICO over time, per `minute`, `hour` (default) or
+    `day` period, optionally between `start` and `end` dates.
+    """
+
+    allowed_methods = ('GET',)
+    authentication_classes = (AdminAuthentication,)
+
+    def get(self, request, *args, **kwargs):
+        company = request.user.company
+
+        try:
+            ico = Ico.objects.select_related('currency').get(company=company,
+                id=kwargs['ico_id'])
+        except Ico.DoesNotExist:
+            raise exceptions.NotFound()
+
+        period = request.query_params.get('period', 'hour')
+        if period not in ('minute', 'hour', 'day',):
+            raise exceptions.ValidationError(
+                {"period": ["Invalid period."]})
+
+        start = request.query_params.get('start')
+        end = request.query_params.get('end')
+
+        series = SalesRollup.objects.get_series(ico, period,
+            start=parse_date(start) if start else None,
+            end=parse_date(end) if end else None)
+
+        data = [{
+            'period': int(row['period'].timestamp() * 1000),
+            'purchase_count': row['purchase_count'],
+            'token_total': to_cents(row['token_total'],
+                ico.currency.divisibility),
+        } for row in series]
+
+        return Response({'status': 'success', 'data': data})
+
+
+class AdminPhaseList(ConditionalGetMixin, ListAPIView):
     """
     List and create phases.
     """
@@ -410,7 +865,7 @@ class AdminPhaseList(ListAPIView):
                          status=status.HTTP_201_CREATED)
 
 
-class AdminPhaseView(GenericAPIView):
+class AdminPhaseView(ConditionalGetMixin, RetrieveAPIView):
     """
     View and delete phases.
     """
@@ -419,7 +874,12 @@ class AdminPhaseView(GenericAPIView):
     serializer_class = AdminPhaseSerializer
     authentication_classes = (AdminAuthentication,)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Phase.objects.filter(id=self.kwargs['phase_id'],
+            ico_id=self.kwargs['ico_id'], ico__company=company)
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         ico_id = kwargs['ico_id']
         phase_id = kwargs['phase_id']
@@ -449,7 +909,7 @@ class AdminPhaseView(GenericAPIView):
         return Response({'status': 'success'})
 
 
-class AdminRateList(ListAPIView):
+class AdminRateList(ConditionalGetMixin, ListAPIView):
     """
     List and create rates.
     """
@@ -472,10 +932,11 @@ class AdminRateList(ListAPIView):
         except Phase.DoesNotExist:
             raise exceptions.NotFound()
 
-        return Rate.objects.filter(phase=phase)
+        return Rate.objects.filter(phase=phase).select_related('currency',
+            'phase__ico__base_currency', 'snapshot')
 
 
-class AdminRateView(GenericAPIView):
+class AdminRateView(ConditionalGetMixin, RetrieveAPIView):
     """
     View, update and delete rates.
     """
@@ -484,14 +945,22 @@ class AdminRateView(GenericAPIView):
     serializer_class = AdminRateSerializer
     authentication_classes = (AdminAuthentication,)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Rate.objects.filter(id=self.kwargs['rate_id'],
+            phase_id=self.kwargs['phase_id'], phase__ico_id=self.kwargs['ico_id'],
+            phase__ico__company=company)
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         ico_id = kwargs['ico_id']
         phase_id = kwargs['phase_id']
         rate_id = kwargs['rate_id']
 
         try:
-            rate = Rate.objects.get(id=rate_id, phase_id=phase_id, 
+            rate = Rate.objects.select_related('currency',
+                'phase__ico__base_currency', 'snapshot').get(id=rate_id,
+                phase_id=phase_id, 
                 phase__ico_id=ico_id, phase__ico__company=company)
         except Rate.DoesNotExist:
             raise exceptions.NotFound()
@@ -500,7 +969,7 @@ class AdminRateView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class AdminQuoteList(ListAPIView):
+class AdminQuoteList(ConditionalGetMixin, CursorPaginationMixin, ListAPIView):
     """
     List and create quotes.
     """
@@ -524,7 +993,45 @@ class AdminQuoteList(ListAPIView):
         return Quote.objects.filter(phase__ico=ico).order_by('-created')
 
 
-class AdminQuoteView(GenericAPIView):
+class AdminQuoteExportView(ExportMixin, GenericAPIView):
+    """
+    Export all quotes of an ICO.
+    """
+
+    authentication_classes = (AdminAuthentication,)
+    export_fields = ('id', 'user', 'phase', 'deposit_currency',
+        'deposit_amount', 'token_currency', 'token_amount', 'rate', 'created',
+        'updated',)
+
+    def get_export_queryset(self):
+        company = self.request.user.company
+
+        try:
+            self.ico = Ico.objects.select_related('currency').get(
+                company=company, id=self.kwargs['ico_id'])
+        except Ico.DoesNotExist:
+            raise exceptions.NotFound()
+
+        self.export_name = 'ico_{}_quotes'.format(self.ico.id)
+
+        return Quote.objects.filter(phase__ico=self.ico).values_list('id',
+            'user__identifier', 'phase_id', 'deposit_currency__code',
+            'deposit_currency__divisibility', 'deposit_amount',
+            'token_amount', 'rate', 'created', 'updated')
+
+    def format_export_row(self, row):
+        (quote_id, user, phase_id, deposit_code, deposit_divisibility,
+            deposit_amount, token_amount, rate, created, updated) = row
+
+        return (quote_id, str(user), phase_id, deposit_code,
+            to_cents(deposit_amount, deposit_divisibility),
+            self.ico.currency.code,
+            to_cents(token_amount, self.ico.currency.divisibility),
+            to_cents(rate, deposit_divisibility),
+            int(created.timestamp() * 1000), int(updated.timestamp() * 1000))
+
+
+class AdminQuoteView(ConditionalGetMixin, RetrieveAPIView):
     """
     View, update and delete quotes.
     """
@@ -533,7 +1040,12 @@ class AdminQuoteView(GenericAPIView):
     serializer_class = AdminQuoteSerializer
     authentication_classes = (AdminAuthentication,)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Quote.objects.filter(id=self.kwargs['quote_id'],
+            phase__ico_id=self.kwargs['ico_id'], phase__ico__company=company)
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         ico_id = kwargs['ico_id']
         quote_id = kwargs['quote_id']
@@ -548,7 +1060,7 @@ class AdminQuoteView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class AdminPurchaseList(ListAPIView):
+class AdminPurchaseList(ConditionalGetMixin, CursorPaginationMixin, ListAPIView):
     """
     List and create purchases.
     """
@@ -557,6 +1069,7 @@ class AdminPurchaseList(ListAPIView):
     pagination_class = ResultsSetPagination
     serializer_class = AdminPurchaseSerializer
     authentication_classes = (AdminAuthentication,)
+    validator_related = ('messages',)
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('id', 'quote__id', 'quote__deposit_currency__code',)
 
@@ -573,7 +1086,59 @@ class AdminPurchaseList(ListAPIView):
                 '-created')
 
 
-class AdminPurchaseView(GenericAPIView):
+class AdminPurchaseExportView(ExportMixin, GenericAPIView):
+    """
+    Export all purchases of an ICO, optionally filtered on `status`.
+    """
+
+    authentication_classes = (AdminAuthentication,)
+    export_fields = ('id', 'status', 'deposit_tx', 'token_tx', 'quote', 'user',
+        'phase', 'deposit_currency', 'deposit_amount', 'token_currency',
+        'token_amount', 'rate', 'created', 'updated',)
+
+    def get_export_queryset(self):
+        company = self.request.user.company
+
+        try:
+            self.ico = Ico.objects.select_related('currency').get(
+                company=company, id=self.kwargs['ico_id'])
+        except Ico.DoesNotExist:
+            raise exceptions.NotFound()
+
+        self.export_name = 'ico_{}_purchases'.format(self.ico.id)
+
+        queryset = Purchase.objects.filter(quote__phase__ico=self.ico)
+
+        purchase_status = self.request.query_params.get('status')
+        if purchase_status:
+            try:
+                queryset = queryset.filter(
+                    status=PurchaseStatus(purchase_status))
+            except ValueError:
+                raise exceptions.ValidationError(
+                    {"status": ["Invalid purchase status."]})
+
+        return queryset.values_list('id', 'status', 'deposit_tx', 'token_tx',
+            'quote_id', 'quote__user__identifier', 'quote__phase_id',
+            'quote__deposit_currency__code',
+            'quote__deposit_currency__divisibility', 'quote__deposit_amount',
+            'quote__token_amount', 'quote__rate', 'created', 'updated')
+
+    def format_export_row(self, row):
+        (purchase_id, purchase_status, deposit_tx, token_tx, quote_id, user,
+            phase_id, deposit_code, deposit_divisibility, deposit_amount,
+            token_amount, rate, created, updated) = row
+
+        return (purchase_id, PurchaseStatus(purchase_status).value,
+            deposit_tx, token_tx, quote_id, str(user), phase_id, deposit_code,
+            to_cents(deposit_amount, deposit_divisibility),
+            self.ico.currency.code,
+            to_cents(token_amount, self.ico.currency.divisibility),
+            to_cents(rate, deposit_divisibility),
+            int(created.timestamp() * 1000), int(updated.timestamp() * 1000))
+
+
+class AdminPurchaseView(ConditionalGetMixin, RetrieveAPIView):
     """
     View, update and delete purchases.
     """
@@ -581,8 +1146,15 @@ class AdminPurchaseView(GenericAPIView):
     allowed_methods = ('GET',)
     serializer_class = AdminPurchaseSerializer
     authentication_classes = (AdminAuthentication,)
+    validator_related = ('messages',)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Purchase.objects.filter(id=self.kwargs['purchase_id'],
+            quote__phase__ico_id=self.kwargs['ico_id'],
+            quote__phase__ico__company=company)
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         ico_id = kwargs['ico_id']
         purchase_id = kwargs['purchase_id']
@@ -597,7 +1169,7 @@ class AdminPurchaseView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class UserIcoList(ListAPIView):
+class UserIcoList(ConditionalGetMixin, ListAPIView):
     """
     List and create ICOs.
     """
@@ -606,16 +1178,18 @@ class UserIcoList(ListAPIView):
     pagination_class = ResultsSetPagination
     serializer_class = UserIcoSerializer
     authentication_classes = (UserAuthentication,)
+    validator_related = ('phase',)
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('id', 'status', 'currency__code',)
 
     def get_queryset(self):
         company = self.request.user.company
         return Ico.objects.exclude(status=IcoStatus.HIDDEN).filter(
-            company=company)
+            company=company).select_related('currency',
+                'base_currency')
 
 
-class UserIcoView(GenericAPIView):
+class UserIcoView(ConditionalGetMixin, RetrieveAPIView):
     """
     View, update and delete ICOs.
     """
@@ -623,8 +1197,14 @@ class UserIcoView(GenericAPIView):
     allowed_methods = ('GET',)
     serializer_class = UserIcoSerializer
     authentication_classes = (UserAuthentication,)
+    validator_related = ('phase',)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Ico.objects.exclude(status=IcoStatus.HIDDEN).filter(
+            company=company, id=self.kwargs['ico_id'])
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         ico_id = kwargs['ico_id']
 
@@ -638,7 +1218,7 @@ class UserIcoView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class UserRateList(ListAPIView):
+class UserRateList(ConditionalGetMixin, ListAPIView):
     """
     List rates.
     """
@@ -661,10 +1241,11 @@ class UserRateList(ListAPIView):
         except (Ico.DoesNotExist, Phase.DoesNotExist):
             raise exceptions.NotFound()
 
-        return Rate.objects.filter(phase=phase)
+        return Rate.objects.filter(phase=phase).select_related('currency',
+            'phase__ico__base_currency', 'snapshot')
 
 
-class UserRateView(GenericAPIView):
+class UserRateView(ConditionalGetMixin, RetrieveAPIView):
     """
     View rates.
     """
@@ -672,8 +1253,14 @@ class UserRateView(GenericAPIView):
     allowed_methods = ('GET',)
     serializer_class = UserRateSerializer
     authentication_classes = (UserAuthentication,)
+    validator_related = ('phase__ico',)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        company = self.request.user.company
+        return Rate.objects.filter(id=self.kwargs['rate_id'],
+            phase__ico_id=self.kwargs['ico_id'], phase__ico__company=company)
+
+    def retrieve(self, request, *args, **kwargs):
         company = request.user.company
         ico_id = kwargs['ico_id']
         rate_id = kwargs['rate_id']
@@ -686,7 +1273,9 @@ class UserRateView(GenericAPIView):
             raise exceptions.NotFound()
 
         try:
-            rate = Rate.objects.get(phase=phase, id=rate_id)
+            rate = Rate.objects.select_related('currency',
+                'phase__ico__base_currency', 'snapshot').get(phase=phase,
+                id=rate_id)
         except Rate.DoesNotExist:
             raise exceptions.NotFound()
 
@@ -694,7 +1283,7 @@ class UserRateView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class UserQuoteList(ListAPIView):
+class UserQuoteList(ConditionalGetMixin, CursorPaginationMixin, ListAPIView):
     """
     List and create quotes.
     """
@@ -708,6 +1297,8 @@ class UserQuoteList(ListAPIView):
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
+            if 'quotes' in self.request.data:
+                return UserCreateBulkQuoteSerializer
             return UserCreateQuoteSerializer
         return super(UserQuoteList, self).get_serializer_class()
 
@@ -725,17 +1316,22 @@ class UserQuoteList(ListAPIView):
             '-created')
 
     def post(self, request, *args, **kwargs):
+        """
+        Create a quote, or a quote for every item of a `quotes` list.
+        """
+
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         ico = serializer.save()
         data = UserQuoteSerializer(serializer.instance, 
+            many=isinstance(serializer.instance, list),
             context={'request': request}).data
         return Response({'status': 'success',
                          'data': data},
                          status=status.HTTP_201_CREATED)
 
 
-class UserQuoteView(GenericAPIView):
+class UserQuoteView(ConditionalGetMixin, RetrieveAPIView):
     """
     View, update and delete quotes.
     """
@@ -744,7 +1340,11 @@ class UserQuoteView(GenericAPIView):
     serializer_class = UserQuoteSerializer
     authentication_classes = (UserAuthentication,)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        return Quote.objects.filter(id=self.kwargs['quote_id'],
+            phase__ico_id=self.kwargs['ico_id'], user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
         ico_id = kwargs['ico_id']
         quote_id = kwargs['quote_id']
 
@@ -758,7 +1358,7 @@ class UserQuoteView(GenericAPIView):
         return Response({'status': 'success', 'data': serializer.data})
 
 
-class UserPurchaseList(ListAPIView):
+class UserPurchaseList(ConditionalGetMixin, CursorPaginationMixin, ListAPIView):
     """
     List and create purchases.
     """
@@ -767,6 +1367,7 @@ class UserPurchaseList(ListAPIView):
     pagination_class = ResultsSetPagination
     serializer_class = UserPurchaseSerializer
     authentication_classes = (UserAuthentication,)
+    validator_related = ('messages',)
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('id', 'quote__id', 'quote__deposit_currency__code',)
 
@@ -784,7 +1385,7 @@ class UserPurchaseList(ListAPIView):
             ).order_by('-created')
 
 
-class UserPurchaseView(GenericAPIView):
+class UserPurchaseView(ConditionalGetMixin, RetrieveAPIView):
     """
     View, update and delete purchases.
     """
@@ -792,15 +1393,21 @@ class UserPurchaseView(GenericAPIView):
     allowed_methods = ('GET',)
     serializer_class = UserPurchaseSerializer
     authentication_classes = (UserAuthentication,)
+    validator_related = ('messages',)
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self):
+        return Purchase.objects.filter(id=self.kwargs['purchase_id'],
+            quote__phase__ico_id=self.kwargs['ico_id'],
+            quote__user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
         user = request.user
         ico_id = kwargs['ico_id']
         purchase_id = kwargs['purchase_id']
 
         try:
             purchase = Purchase.objects.get(id=purchase_id, 
-                quote__phase__ico_id=ico_id, quote__phase__user=user)
+                quote__phase__ico_id=ico_id, quote__user=user)
         except Purchase.DoesNotExist:
             raise exceptions.NotFound()
 